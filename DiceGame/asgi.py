@@ -10,21 +10,33 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "DiceGame.settings")
+# Django has to be set up before anything that imports the models, so this is done first (e.g. when daphne runs this module itself).
+django_asgi_app = get_asgi_application()
+
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 
-from api.auth import BasicAuthMiddleware
+from api import odds
+from api.auth import BasicAuthMiddleware, TicketAuthMiddleware
 from api.routing import websocket_urlpatterns
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "DiceGame.settings")
+# The odds are loaded (or calculated and cached) when the server starts, so requests never have to calculate them.
+# This isn't done for other management commands (e.g. migrate), which don't need them.
+odds.load()
 
 # application = get_asgi_application()
 application = ProtocolTypeRouter(
     {
-        "http": get_asgi_application(),
+        "http": django_asgi_app,
         "websocket": AllowedHostsOriginValidator(
-            AuthMiddlewareStack(BasicAuthMiddleware(URLRouter(websocket_urlpatterns)))
+            AuthMiddlewareStack(
+                BasicAuthMiddleware(
+                    TicketAuthMiddleware(URLRouter(websocket_urlpatterns))
+                )
+            )
         ),
     }
 )
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 from django.contrib.messages import constants as messages
 
@@ -88,6 +89,32 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The leaderboard and the results of finished games are cached (see api/caching.py).
+# Each process has its own local memory cache, so switch to a shared backend (e.g. Redis) when running several processes.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+# This is how many values each process keeps in its own LRU in front of the cache.
+PAGE_CACHE_SIZE = 1000
+
+# These are how many seconds the leaderboard and the results of a finished game are cached for.
+# The leaderboard is also invalidated whenever a game finishes, and results never change (apart from usernames).
+LEADERBOARD_CACHE_TTL = 60
+RESULTS_CACHE_TTL = 24 * 60 * 60
+
+# These are how many seconds the API's snapshots of live and finished games are cached for (see GameViewSet.retrieve).
+# Finished games are also sent with this max-age, while live games have to be revalidated with their ETag on every request.
+GAME_SNAPSHOT_TTL = 2
+FINISHED_GAME_CACHE_TTL = 24 * 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -156,6 +183,38 @@ MESSAGE_TAGS = {
 
 ASGI_APPLICATION = "DiceGame.asgi.application"
 
+# The exact odds of the game are calculated once and saved here (see api/odds.py), outside the source tree.
+ODDS_CACHE_PATH = Path(tempfile.gettempdir()) / "dicegame-odds.json"
+
+# This is how many seconds a player has to acknowledge their roll before they forfeit the game.
+TURN_TIMEOUT = 60
+
+# This is how many seconds a player waits for an opponent to join before they are disconnected and the game is deleted.
+WAITING_TIMEOUT = 10 * 60
+
+# Recently verified websocket credentials are cached for this many seconds, up to this many at a time (see api/auth.py).
+AUTH_CACHE_TTL = 300
+AUTH_CACHE_SIZE = 10000
+
+# Websocket tickets (see api/auth.py) can be used for this many seconds after they are issued.
+TICKET_TTL = 60
+
+# Each websocket can send this many messages a second on average, in bursts of up to WEBSOCKET_BURST (see api/throttling.py).
+# Messages over the limit are dropped, and a websocket that has WEBSOCKET_DROP_LIMIT dropped is closed.
+# Dropped messages are forgiven at WEBSOCKET_DROP_RECOVERY a second, so any client that keeps sending faster than
+# WEBSOCKET_RATE + WEBSOCKET_DROP_RECOVERY messages a second is closed eventually, while an occasional burst is not.
+WEBSOCKET_RATE = 5
+WEBSOCKET_BURST = 10
+WEBSOCKET_DROP_LIMIT = 50
+WEBSOCKET_DROP_RECOVERY = 0.1
+
+# This is how many frames can be waiting to be sent to a spectator before they are disconnected for falling behind.
+SPECTATOR_BUFFER = 64
+
+# If this is set, every game's dice seed is derived from it and the game code instead of being random (see api/dice.py).
+# This should only be used for deterministic load tests, as anyone who knows it can work out every roll.
+DICE_SEED = None
+
 CHANNEL_LAYERS = {
     "default": {
         ### Method 1: Via redis lab
@@ -171,7 +230,12 @@ CHANNEL_LAYERS = {
         #      "hosts": [('127.0.0.1', 6379)],
         # },
         ### Method 3: Via In-memory channel layer
+        # "BACKEND": "channels.layers.InMemoryChannelLayer",
+        ### Method 4: Via the in-process layer tuned for two player games (see api/layers.py)
         ## Using this method.
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "BACKEND": "api.layers.PairChannelLayer",
+        "CONFIG": {
+            "capacity": 100,
+        },
     },
 }
@@ -5,6 +5,7 @@ from api import views
 router = routers.DefaultRouter()
 router.register(r"users", views.UserViewSet, basename="user")
 router.register(r"games", views.GameViewSet, basename="game")
+router.register(r"odds", views.OddsViewSet, basename="odds")
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
@@ -1,9 +1,24 @@
 import base64
 import binascii
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
 
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.db import router
+
+from .models import User
+from .routing import GAME_PATH
+
+# This is the salt websocket tickets are signed with, so no other signed value can be used as one.
+TICKET_SALT = "api.auth.ticket"
 
 
 @database_sync_to_async
@@ -11,6 +26,85 @@ def get_user(username, password):
     return authenticate(username=username, password=password)
 
 
+# This returns whether the supplied (cached) user still has the same username and password hash, and is still active.
+# Changing or deleting a user only invalidates the cache of the worker that served the request, so other workers check this
+# before trusting their entries. It is a single primary key lookup, much cheaper than hashing the password again.
+@database_sync_to_async
+def is_unchanged(user):
+    return User.objects.filter(
+        pk=user.pk, username=user.username, password=user.password, is_active=True
+    ).exists()
+
+
+class CredentialCache:
+    """
+    A bounded cache of recently verified basic auth headers, so clients that reconnect often don't cost a password hash every time.
+    Entries are keyed by an HMAC of the header (keyed with SECRET_KEY), so the credentials themselves are never kept.
+    They expire after AUTH_CACHE_TTL seconds, and the least recently used are evicted once there are more than AUTH_CACHE_SIZE.
+    Each worker has its own cache, so entries are checked against the user's row before they are used (see is_unchanged).
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        # This maps each key to (the user, the time the entry expires), least recently used first.
+        self.entries = OrderedDict()
+        # This maps each user's primary key to their keys, so their entries can be found when invalidating.
+        self.keys = {}
+        # The cache is used from both the event loop (the middleware) and the thread sync views run in.
+        self.lock = threading.Lock()
+
+    def key(self, header):
+        return hmac.new(settings.SECRET_KEY.encode(), header, hashlib.sha256).digest()
+
+    # This returns the user the supplied header was verified as, or None if it isn't cached (or has expired).
+    def get(self, header):
+        key = self.key(header)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, header, user):
+        key = self.key(header)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (user, time.monotonic() + self.ttl)
+            self.keys.setdefault(user.pk, set()).add(key)
+            while len(self.entries) > self.size:
+                self.remove(next(iter(self.entries)))
+
+    # This must be called with the lock held.
+    def remove(self, key):
+        user, _ = self.entries.pop(key)
+        keys = self.keys.get(user.pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys[user.pk]
+
+    # This forgets every header verified as the supplied user, e.g. when their password changes or they are deleted.
+    def invalidate(self, user_pk):
+        with self.lock:
+            for key in list(self.keys.get(user_pk, ())):
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys.clear()
+
+
+# This is the credential cache for this worker.
+credentials = CredentialCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+
+
 class BasicAuthMiddleware:
     """
     Custom middleware that decodes a Base64 encoded basic auth header and sets the user on the scope.
@@ -32,16 +126,72 @@ class BasicAuthMiddleware:
         headers = scope["headers"]
         for header in headers:
             if header[0].decode() == "authorization":
+                # Headers that have been verified recently skip the password hasher (see CredentialCache).
+                user = credentials.get(header[1])
+                if user is not None:
+                    if await is_unchanged(user):
+                        scope["user"] = user
+                        continue
+                    credentials.invalidate(user.pk)
                 try:
                     encoded_credentials = header[1].decode().split(" ")[1]
                     username, password = (
                         base64.b64decode(encoded_credentials).decode("utf-8").split(":")
                     )
-                    scope["user"] = await get_user(username, password)
+                    user = await get_user(username, password)
                 except binascii.Error:  # invalid base64
-                    pass
+                    continue
+                # Credentials that failed to authenticate leave the user anonymous.
+                scope["user"] = user or AnonymousUser()
+                if user is not None:
+                    credentials.set(header[1], user)
 
         if not "user" in scope.keys():
             scope["user"] = AnonymousUser()
 
         return await self.app(scope, receive, send)
+
+
+# This returns a ticket that lets the supplied user connect to the supplied game's websockets for the next TICKET_TTL seconds.
+# The ticket is the user and game signed with an HMAC (keyed with SECRET_KEY) along with the time it was issued.
+def issue_ticket(user, game_id):
+    return signing.dumps([user.pk, user.username, game_id], salt=TICKET_SALT)
+
+
+# This returns the user the supplied ticket was issued to, or None if it is invalid, has expired or is for a different game.
+# Only the signature is checked, so the user is built from the ticket rather than loaded from the database.
+# Their other fields are deferred, so they would only be loaded if something used them.
+def verify_ticket(ticket, game_id):
+    try:
+        pk, username, ticket_game_id = signing.loads(
+            ticket, salt=TICKET_SALT, max_age=settings.TICKET_TTL
+        )
+    except signing.BadSignature:  # also raised when the ticket has expired
+        return None
+    if ticket_game_id != game_id:
+        return None
+    return User.from_db(router.db_for_read(User), ["id", "username"], [pk, username])
+
+
+class TicketAuthMiddleware:
+    """
+    Custom middleware that sets the user on the scope from a ticket in the query string (?ticket=..., see issue_ticket).
+    This costs an HMAC check rather than a password hash and a database query, so it is the cheapest way for clients to connect.
+    A ticket that is invalid, has expired or is for a different game leaves the user as an AnonymousUser.
+    Connections without a ticket are left untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            return await self.app(scope, receive, send)
+
+        tickets = parse_qs(scope["query_string"].decode()).get("ticket")
+        if tickets:
+            match = GAME_PATH.match(scope["path"])
+            user = verify_ticket(tickets[0], match.group("id")) if match else None
+            scope["user"] = user or AnonymousUser()
+
+        return await self.app(scope, receive, send)
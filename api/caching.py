@@ -0,0 +1,132 @@
+# Here, the cache the pages read the leaderboard and the results of finished games through is defined.
+# There are two levels: a small LRU in each process, which is checked first and costs nothing to read,
+# and Django's cache framework (see CACHES in settings.py), which is shared between processes if a shared backend is configured.
+# Values are invalidated when a game finishes (see GameState.flush), and otherwise expire after the timeout they were set with.
+# Django's cache holds each value with the time it expires, so a copy in the LRU never outlives the value it was copied from.
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+# These are the keys of the cached values.
+LEADERBOARD = "leaderboard"
+
+
+def results_key(game_id):
+    return f"results:{game_id}"
+
+
+def game_key(game_id):
+    return f"game:{game_id}"
+
+
+# This is set once the supplied user (None if anonymous) has passed the permission check for retrieving the supplied game.
+def game_access_key(game_id, user_pk):
+    return f"game:{game_id}:access:{user_pk}"
+
+
+class LRUCache:
+    """
+    A bounded cache of values in this process's memory, with an optional expiry time for each.
+    The least recently used values are evicted once there are more than size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # This maps each key to (the value, the time it expires or None), least recently used first.
+        self.entries = OrderedDict()
+        # The views run in threads, so the cache can be used from several at once.
+        self.lock = threading.Lock()
+
+    # This returns the value cached under the supplied key, or None if it isn't cached (or has expired).
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.entries[key] = (
+                value,
+                None if timeout is None else time.monotonic() + timeout,
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# This is the LRU for this process.
+local = LRUCache(settings.PAGE_CACHE_SIZE)
+
+
+# This returns the value cached under the supplied key, or None if it isn't cached.
+# Values found in Django's cache are copied into the LRU until they expire there.
+def get(key):
+    value = local.get(key)
+    if value is None:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is None:
+            local.set(key, value)
+        else:
+            remaining = expires - time.time()
+            if remaining <= 0:
+                return None
+            local.set(key, value, remaining)
+    return value
+
+
+# This caches a value in both levels for timeout seconds, or until it is invalidated if timeout is None.
+def set(key, value, timeout=None):
+    expires = None if timeout is None else time.time() + timeout
+    cache.set(key, (value, expires), timeout)
+    local.set(key, value, timeout)
+
+
+# This returns the value cached under the supplied key, calling compute to get it (and caching it for timeout seconds) if it isn't cached.
+# Values must not be None, or they will be computed every time.
+def get_or_set(key, compute, timeout=None):
+    value = get(key)
+    if value is None:
+        value = compute()
+        if value is not None:
+            set(key, value, timeout)
+    return value
+
+
+def delete(key):
+    local.delete(key)
+    cache.delete(key)
+
+
+# This is called when a game finishes, as it may have a place on the leaderboard and its snapshot (see GameViewSet.retrieve) has changed.
+# Results are only cached once a game has finished, so there shouldn't be any for it yet, but they are dropped just in case.
+async def game_finished(game_id):
+    keys = [LEADERBOARD, results_key(game_id), game_key(game_id)]
+    for key in keys:
+        local.delete(key)
+    await cache.adelete_many(keys)
+
+
+def clear():
+    local.clear()
+    cache.clear()
@@ -0,0 +1,161 @@
+# Here, the router that spreads games across several worker processes on one host is defined.
+# The game state and channel layer live in each worker's memory, so both players (and everything else to do with a game) must reach the same worker.
+# The router sits in front of the workers and sends every connection for a game to the worker its code hashes to, and everything else round robin.
+# It is run with "python manage.py run_cluster".
+
+import asyncio
+import bisect
+import hashlib
+import itertools
+
+from .routing import GAME_PATH
+
+# This is the most a client can send before the end of its request's headers, beyond which the connection is dropped.
+MAX_HEAD_SIZE = 64 * 1024
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    A consistent hash ring of worker names.
+    Each worker is placed on the ring at many points (replicas), and a key belongs to the first worker clockwise of its hash.
+    So adding a worker only moves the keys that now fall just before its points, roughly 1/N of them, and the rest stay where they were.
+    """
+
+    def __init__(self, workers=(), replicas=128):
+        self.replicas = replicas
+        self.points = []
+        self.owners = {}
+        for worker in workers:
+            self.add(worker)
+
+    def __len__(self):
+        return len(set(self.owners.values()))
+
+    def add(self, worker):
+        for replica in range(self.replicas):
+            point = ring_hash(f"{worker}#{replica}")
+            bisect.insort(self.points, point)
+            self.owners[point] = worker
+
+    def get(self, key):
+        if not self.points:
+            raise LookupError("There are no workers on the ring.")
+        index = bisect.bisect(self.points, ring_hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
+
+
+class Router:
+    """
+    A TCP proxy in front of the workers, each of which is a daphne process listening on a Unix domain socket.
+    Only the first request line of each connection is looked at, after which bytes are passed through untouched both ways.
+    Games with open connections are pinned to the worker they are on, so if a worker is added while they are being played
+    (which changes the ring), their players keep meeting in the same worker until the game is over. See rebalance().
+    """
+
+    def __init__(self, replicas=128):
+        self.ring = HashRing(replicas=replicas)
+        # This maps each worker's name to the path of its socket.
+        self.workers = {}
+        # This maps the code of each game with open connections to [the worker it is on, the number of open connections].
+        self.pins = {}
+        self.round_robin = itertools.cycle([])
+        self.connections = 0
+
+    def add_worker(self, name, path):
+        self.workers[name] = path
+        self.ring.add(name)
+        self.round_robin = itertools.cycle(list(self.workers))
+
+    # This adds a worker and rebalances the ring, returning how many live games would have moved if they weren't pinned.
+    # New games (and live games once they are over) go to their new worker straight away.
+    def rebalance(self, name, path):
+        self.add_worker(name, path)
+        return sum(
+            1 for game, pin in self.pins.items() if self.ring.get(game) != pin[0]
+        )
+
+    # This returns the worker a connection to the supplied path should go to, and the game code if it is for a game.
+    def route(self, path):
+        match = GAME_PATH.match(path)
+        if match is None:
+            return next(self.round_robin), None
+        game = match.group("id")
+        pin = self.pins.get(game)
+        return (pin[0] if pin else self.ring.get(game)), game
+
+    def pin(self, game, worker):
+        self.pins.setdefault(game, [worker, 0])[1] += 1
+
+    def unpin(self, game):
+        pin = self.pins[game]
+        pin[1] -= 1
+        if not pin[1]:
+            del self.pins[game]
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(
+            self.handle, host, port, limit=MAX_HEAD_SIZE
+        )
+
+    async def handle(self, client_reader, client_writer):
+        game = None
+        worker_writer = None
+        self.connections += 1
+        try:
+            try:
+                head = await client_reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            target = head.split(b"\r\n", 1)[0].split(b" ")
+            path = target[1].decode("latin-1") if len(target) == 3 else "/"
+
+            worker, game = self.route(path)
+            if game is not None:
+                self.pin(game, worker)
+            try:
+                worker_reader, worker_writer = await asyncio.open_unix_connection(
+                    self.workers[worker]
+                )
+            except OSError:
+                client_writer.write(
+                    b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+                return
+            worker_writer.write(head)
+            await asyncio.gather(
+                self.pipe(client_reader, worker_writer),
+                self.pipe(worker_reader, client_writer),
+            )
+        finally:
+            self.connections -= 1
+            if game is not None:
+                self.unpin(game)
+            if worker_writer is not None:
+                worker_writer.close()
+            client_writer.close()
+
+    # This copies everything from one side to the other until either side closes.
+    async def pipe(self, reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if writer.can_write_eof():
+                try:
+                    writer.write_eof()
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {
+            "workers": len(self.workers),
+            "connections": self.connections,
+            "live_games": len(self.pins),
+        }
@@ -1,452 +1,651 @@
 # Here, the logic when a user connects to the websocket is defined. This is where all the game logic takes place.
 # Everything is generated server-side to prevent cheating on the client-side (e.g. if RNG was done on the client side, the user could modify the code to roll a 6 every time).
+# The consumer is asynchronous so a single worker can host many games at once without a thread per connection.
+# Both consumers of a game share its in-memory GameState (see state.py), so turns are played without touching the database.
+# The Game row is written back at round boundaries, when the game ends and when a player disconnects.
+# Anyone can also watch a live game through SpectatorConsumer, which is sent frames straight from the GameState.
 
+import asyncio
 import json
-import random
-
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
-from .models import Game
-
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from . import odds, protocol, rules
+from . import state as game_state
+from .models import Game, GameEvent
+from .throttling import TokenBucket
+from .timeouts import wheel
+
+
+class GameConsumer(AsyncWebsocketConsumer):
+    """
+    The parts shared by the players' and spectators' consumers.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages = TokenBucket(settings.WEBSOCKET_RATE, settings.WEBSOCKET_BURST)
+        self.drops = TokenBucket(
+            settings.WEBSOCKET_DROP_RECOVERY, settings.WEBSOCKET_DROP_LIMIT
+        )
+        # This is set once the client is being disconnected for sending too many messages, after which anything else it sends is ignored.
+        self.closing = False
 
-class DiceGameConsumer(WebsocketConsumer):
+    # This sends a frame to the client in the format it asked for when it connected.
+    async def send_frame(self, frame):
+        if self.subprotocol == protocol.BINARY:
+            await self.send(bytes_data=protocol.encode(frame))
+        else:
+            await self.send(text_data=json.dumps(frame))
+
+    # This sends a frame that the sender of a group message wrapped in protocol.Encoded, so it is only encoded once in each format.
+    async def send_encoded(self, frame):
+        # Channel layers that serialise messages hand over a plain dict.
+        if not isinstance(frame, protocol.Encoded):
+            frame = protocol.Encoded(frame["frame"])
+        if self.subprotocol == protocol.BINARY:
+            await self.send(bytes_data=frame["bytes"])
+        else:
+            await self.send(text_data=frame["text"])
+
+    # This returns whether a message the client has sent should be handled, which is checked before anything else is done with it.
+    # Messages over WEBSOCKET_RATE a second (after a burst of WEBSOCKET_BURST) are dropped without a reply,
+    # and a client that keeps sending them until WEBSOCKET_DROP_LIMIT have been dropped (forgiven at WEBSOCKET_DROP_RECOVERY a second) is disconnected.
+    async def throttle(self):
+        if self.closing:
+            return False
+        if self.messages.take():
+            return True
+        if not self.drops.take():
+            self.closing = True
+            await self.send_frame({"message": "too many messages"})
+            await self.close()
+        return False
+
+    # This accepts the connection just to tell the client why it can't join, then closes it.
+    async def refuse(self, message):
+        if self.state is not None:
+            game_state.release(self.state)
+            self.state = None
+        await self.accept(self.subprotocol)
+        await self.send_frame({"message": message})
+        await self.close()
+
+
+class DiceGameConsumer(GameConsumer):
     # This is the logic that runs when a user connects to the websocket.
-    def connect(self):
+    async def connect(self):
         # This defines a channel name (game code) so the server can ping out events to the correct game.
         self.game_group_name = self.scope["url_route"]["kwargs"]["id"]
+        self.user = None
+        # Clients can opt in to a single "turn" frame per turn, instead of a frame with the roll followed by an update frame, with ?frames=turn.
+        query = parse_qs(self.scope["query_string"].decode())
+        self.coalesce = query.get("frames") == ["turn"]
+        # Clients can ask for binary frames instead of JSON through the websocket subprotocol (see protocol.py).
+        self.subprotocol = protocol.negotiate(self.scope["subprotocols"])
 
         # The following is some error handling to make sure the game exists and the user is authorised to play it.
-        try:
-            self.game = Game.objects.get(id=self.game_group_name)
-        except Game.DoesNotExist:
-            self.game = None
-            self.accept()
-            self.send(text_data=json.dumps({"message": "game does not exist"}))
-            self.close()
+        self.state = await game_state.acquire(self.game_group_name)
+        if self.state is None:
+            await self.refuse("game does not exist")
             return
-        if self.game.finished:
-            self.accept()
-            self.send(text_data=json.dumps({"message": "game has finished"}))
-            self.close()
+        if self.state.finished:
+            await self.refuse("game has finished")
+            return
+
+        if self.scope["user"].is_anonymous:
+            await self.refuse("unauthorised")
             return
 
         self.user = self.scope["user"]
 
-        if self.user.is_anonymous:
-            # or not self.game.players.contains(self.user)
-            self.user = None
-            self.accept()
-            self.send(text_data=json.dumps({"message": "unauthorised"}))
-            self.close()
+        # We give the player a seat, if both are taken by other players they can only watch (see SpectatorConsumer).
+        if self.state.take_seat(self.user) is None:
+            await self.refuse("game is full")
             return
 
         # The consumer is added to a group with the other player so events can be pinged out.
-        async_to_sync(self.channel_layer.group_add)(
-            self.game_group_name, self.channel_name
-        )
+        await self.channel_layer.group_add(self.game_group_name, self.channel_name)
 
-        self.accept()
+        await self.accept(self.subprotocol)
 
         # We add the player to the list of players and the connected_players.
-        if not self.game.players.contains(self.user):
-            self.game.players.add(self.user)
-        self.game.connected_players.add(self.user)
-        self.game.save()
+        self.state.connected.add(self.user.pk)
+        await self.join_game()
 
         # If we have 2 players, we start the game.
-        if self.game.connected_players.count() == 2:
-            if not self.game.current_player:
-                self.game.current_player = self.game.players.first()
-                self.game.save()
-
-            async_to_sync(self.channel_layer.group_send)(
+        if len(self.state.connected) == 2:
+            # The first player is no longer waiting for an opponent (see waiting_timeout).
+            wheel.cancel(self.game_group_name)
+            if not self.state.current_player_id:
+                self.state.current_player = self.state.player1
+            await self.state.flush()
+
+            # Group messages carry their frames wrapped in protocol.Encoded, so each frame is only serialised once however many sockets receive it.
+            frame = protocol.Encoded(
+                {
+                    "message": "ready",
+                    "player1": self.state.player1.username,
+                    "player2": self.state.player2.username,
+                }
+            )
+            await self.channel_layer.group_send(
                 self.game_group_name,
-                {"type": "game.ready"},
+                {"type": "game.ready", "frame": frame},
             )
+            self.state.broadcast(frame)
 
-            async_to_sync(self.channel_layer.group_send)(
+            await self.channel_layer.group_send(
                 self.game_group_name,
                 {"type": "game.main"},
             )
         else:
-            self.send(text_data=json.dumps({"message": "waiting for another player"}))
+            # The seat is written straight away, so the game's version (and so its ETag, see GameViewSet.retrieve) changes with its players.
+            await self.state.flush()
+            await self.send_frame({"message": "waiting for another player"})
+            # If no one joins in time, the player is disconnected and the game is deleted, so idle games don't live forever.
+            wheel.arm(
+                self.game_group_name, settings.WAITING_TIMEOUT, self.waiting_timeout
+            )
             return
 
     # This is the logic that runs when a player disconnects.
-    def disconnect(self, _code):
+    async def disconnect(self, _code):
         # If the user is disconnecting because they joined an invalid game, we don't need to do anything.
-        if not self.game:
+        if not self.state:
             return
 
-        if not self.user:
-            return
+        self.state.connected.discard(self.user.pk)
+        wheel.cancel(self.game_group_name)
 
         # If the game isn't finished, to avoid things being messy we simply delete the game and disconnect the other player.
-        # This is handled in the game.abort event.
-        if not self.game.finished:
-            async_to_sync(self.channel_layer.group_send)(
+        # This is handled in the game.abort event. Any spectators are disconnected too.
+        if not self.state.finished:
+            await self.channel_layer.group_send(
                 self.game_group_name,
                 {"type": "game.abort"},
             )
+            self.state.broadcast(
+                protocol.Encoded({"message": "player disconnected", "abort": True}),
+                last=True,
+            )
 
-        async_to_sync(self.channel_layer.group_discard)(
-            self.game_group_name, self.channel_name
-        )
+        await self.channel_layer.group_discard(self.game_group_name, self.channel_name)
 
-        # The user is removed from the connected_players list.
-        try:
-            self.game.refresh_from_db()
-            self.game.connected_players.remove(self.user)
-            self.game.save()
-        except Game.DoesNotExist:
-            pass
+        # Any changes that haven't been written back yet are flushed, and the user is removed from the connected_players list.
+        await self.state.flush()
+        await self.leave_game()
+        game_state.release(self.state)
 
     # This is the logic that runs when the server receives a message from the client.
     # This only is used so the client acknowledges their roll so the game can progress.
-    # If they take too long, they are automatically disconnected.
-    def receive(self, text_data):
-        self.game.refresh_from_db()
+    # If they take too long, they forfeit the game (see turn_timeout).
+    async def receive(self, text_data=None, bytes_data=None):
+        # Clients sending too many messages (e.g. spamming out of turn) are throttled before anything else is done.
+        if not await self.throttle():
+            return
+
+        # Once the game is over (e.g. the other player forfeited), nothing the client sends matters.
+        if self.state.finished:
+            return
 
         # We check if there are 2 players connected.
-        if self.game.connected_players.count() != 2:
-            self.send(text_data=json.dumps({"message": "waiting for another player"}))
+        if len(self.state.connected) != 2:
+            await self.send_frame({"message": "waiting for another player"})
             return
 
         # We check if it is the user's turn.
-        if self.game.current_player != self.user:
-            self.send(text_data=json.dumps({"message": "not your turn"}))
+        if self.state.current_player_id != self.user.pk:
+            await self.send_frame({"message": "not your turn"})
             return
 
+        # The player has acknowledged in time, so their turn deadline is cancelled.
+        wheel.cancel(self.game_group_name)
+
         # If the game is in "tiebreaker mode", we want to run the tiebreaker logic, else just run the main game loop.
-        if self.game.tiebreaker:
-            self.game_end_tie(None)
+        if self.state.tiebreaker:
+            await self.game_end_tie(None)
             return
 
-        self.game_main(None)
+        await self.game_main(None)
 
     # This logic is run when the game ends early (a user disconnects) and terminates the game.
-    def game_abort(self, _event):
+    async def game_abort(self, _event):
         # This sends a message to the client to handle the abort client-side (e.g. redirecting to the home page).
-        self.send(
-            text_data=json.dumps({"message": "player disconnected", "abort": True})
-        )
-        try:
-            self.game.delete()
-        except Game.DoesNotExist:
-            pass
-        self.close()
+        await self.send_frame({"message": "player disconnected", "abort": True})
+        game_state.discard(self.state)
+        await self.delete_game()
+        await self.close()
 
     # This logic is run when 2 players are connected and the clients are notified of the other player's username.
-    def game_ready(self, _event):
-        self.send(
-            text_data=json.dumps(
-                {
-                    "message": "ready",
-                    "player1": self.game.players.first().username,
-                    "player2": self.game.players.last().username,
-                }
-            )
-        )
+    async def game_ready(self, event):
+        await self.send_encoded(event["frame"])
 
     # This is the main game loop, it handles rolling and score calculation.
-    def game_main(self, _event):
-        self.game.refresh_from_db()
+    async def game_main(self, _event):
+        game = self.state
 
         # Since this is called on both consumers (players), we need to make sure the user is the current player.
-        if self.user != self.game.current_player:
+        if self.user.pk != game.current_player_id:
             return
 
-        # The roll is calculated as a list.\
-        # If it's a double, we append a 3rd roll.
-        roll = [random.randint(1, 6), random.randint(1, 6)]
-        if roll[0] == roll[1]:
-            roll += [random.randint(1, 6)]
+        is_player1 = game.current_player_id == game.player1.pk
 
         # If both players have rolled and the current player is back to the first player, we reset the rolls and increment the round.
-        if (
-            self.game.player1_roll
-            and self.game.player2_roll
-            and self.game.current_player == self.game.players.first()
-        ):
-            if self.game.round == 5:
-                async_to_sync(self.channel_layer.group_send)(
+        # This is a round boundary, so the finished round is written back to the database.
+        if game.player1_roll and game.player2_roll and is_player1:
+            if game.round == rules.ROUNDS:
+                await self.channel_layer.group_send(
                     self.game_group_name,
                     {"type": "game.end", "tie": False},
                 )
                 return
 
-            self.game.round += 1
-            self.game.player1_roll = 0
-            self.game.player2_roll = 0
-            self.game.save()
+            game.round += 1
+            game.player1_roll = 0
+            game.player2_roll = 0
+            await game.flush()
 
         # If the current player hasn't rolled, we send them their roll and wait for them to acknowledge it.
-        if (
-            self.game.current_player == self.game.players.first()
-            and not self.game.player1_roll
-        ) or (
-            self.game.current_player == self.game.players.last()
-            and not self.game.player2_roll
+        # The roll is calculated as a list from the game's dice. If it's a double, a 3rd roll is appended (see rules.py).
+        if (is_player1 and not game.player1_roll) or (
+            not is_player1 and not game.player2_roll
         ):
-            self.send(
-                text_data=json.dumps(
-                    {
-                        "message": "your roll",
-                        "roll": roll,
-                        "double": roll[0] == roll[1],
-                        "tiebreaker": False,
-                    }
-                )
-            )
-
-            if self.user == self.game.players.first():
-                self.game.player1_roll = roll
+            roll = rules.roll(game.dice)
+            if is_player1:
+                game.player1_roll = roll
             else:
-                self.game.player2_roll = roll
-            self.game.save()
+                game.player2_roll = roll
+            game.record(GameEvent.ROLL, 1 if is_player1 else 2, roll)
+
+            await self.send_frame(
+                {
+                    "message": "your roll",
+                    "roll": roll,
+                    "double": rules.is_double(roll),
+                    "tiebreaker": False,
+                }
+            )
+            self.start_turn_timer()
 
             return
 
         # If the current player has rolled and sent an acknowledgement, we send the other player their roll so they can see it with the pre_update event.
-        if self.game.current_player == self.game.players.first():
-            roll = self.game.player1_roll
+        if is_player1:
+            roll = game.player1_roll
         else:
-            roll = self.game.player2_roll
+            roll = game.player2_roll
 
-        async_to_sync(self.channel_layer.group_send)(
-            self.game_group_name,
-            {
-                "type": "game.pre_update",
-                "player": self.user.username,
-                "roll": roll,
-                "double": roll[0] == roll[1],
-                "tiebreaker": False,
-            },
-        )
+        # We calculate the score and update the game.
+        score = rules.score(roll)
 
-        # We calculate the score and update the database.
-        score = sum(roll)
-
-        # If it's a double, we add 10 points, else we subtract 5.
-        if sum(roll[:2]) % 2 == 0:
-            score += 10
+        if is_player1:
+            game.player1_score += score
+            score = game.player1_score
         else:
-            score -= 5
-
-        # If the score is negative, we set it to 0.
-        score = max(score, 0)
+            game.player2_score += score
+            score = game.player2_score
+        game.record(GameEvent.SCORE, 1 if is_player1 else 2, roll, score)
 
-        if self.game.current_player == self.game.players.first():
-            self.game.player1_score += score
-            score = self.game.player1_score
-        else:
-            self.game.player2_score += score
-            score = self.game.player2_score
-        self.game.save()
+        # We switch the current player.
+        game.current_player = game.player2 if is_player1 else game.player1
+
+        # Each player's chance of winning from here is looked up from the precalculated odds (see odds.py).
+        player1_win_probability, player2_win_probability = odds.win_probability(
+            game.round,
+            2 if is_player1 else 1,
+            game.player1_score,
+            game.player2_score,
+        )
 
-        # We send both players the round number and the score so they can update.
-        async_to_sync(self.channel_layer.group_send)(
-            self.game_group_name,
+        # We send both players the turn, which also calls the main game loop again for the next roll.
+        await self.send_turn(
             {
-                "round": self.game.round,
-                "type": "game.update",
                 "player": self.user.username,
                 "roll": roll,
+                "double": rules.is_double(roll),
+                "tiebreaker": False,
+                "round": game.round,
                 "score": score,
-            },
+                "player1_score": game.player1_score,
+                "player2_score": game.player2_score,
+                "next_player": game.current_player.username,
+                "winner": None,
+                "player1_win_probability": player1_win_probability,
+                "player2_win_probability": player2_win_probability,
+            }
         )
 
-        # We switch the current player.
-        self.game.current_player = self.game.players.exclude(
-            username=self.game.current_player.username
-        ).first()
-        self.game.save()
-
-        # We call the main game loop again for the next roll.
-        async_to_sync(self.channel_layer.group_send)(
-            self.game_group_name,
-            {"type": "game.main"},
-        )
-
-    # This logic is called when the current player receives their roll and acknowledges it.
-    # It provides the other player with the current player's roll so they can display it however the client can.
-    def game_pre_update(self, event):
-        self.game.refresh_from_db()
-
-        if self.user.username == event["player"]:
-            return
-
-        self.send(
-            text_data=json.dumps(
+    # This sends a turn that has just been played to the group.
+    # Each frame a consumer might send for it is built here, and is only encoded (once per format) if a consumer or spectator forwards it (see game_turn).
+    async def send_turn(self, turn):
+        frames = {
+            "turn": protocol.Encoded({"message": "turn", **turn}),
+            "roll": protocol.Encoded(
                 {
-                    "message": f"{event['player']}'s roll",
-                    "roll": event["roll"],
-                    "double": event["double"],
-                    "tiebreaker": event["tiebreaker"],
+                    "message": f"{turn['player']}'s roll",
+                    "roll": turn["roll"],
+                    "double": turn["double"],
+                    "tiebreaker": turn["tiebreaker"],
                 }
-            )
-        )
-
-    # This logic is called when the score has been calculated and sends the round number, player, roll, and score to both players.
-    def game_update(self, event):
-        self.game.refresh_from_db()
-
-        self.send(
-            text_data=json.dumps(
+            ),
+            # Outside of the tiebreaker, both players are sent the round number, player, roll, score and each player's current chance of winning.
+            "update": None
+            if turn["tiebreaker"]
+            else protocol.Encoded(
                 {
                     "message": "update",
-                    "round": event["round"],
-                    "player": event["player"],
-                    "roll": event["roll"],
-                    "score": event["score"],
+                    "round": turn["round"],
+                    "player": turn["player"],
+                    "roll": turn["roll"],
+                    "score": turn["score"],
+                    "player1_win_probability": turn["player1_win_probability"],
+                    "player2_win_probability": turn["player2_win_probability"],
                 }
-            )
+            ),
+        }
+        await self.channel_layer.group_send(
+            self.game_group_name,
+            {
+                "type": "game.turn",
+                "player": turn["player"],
+                "tiebreaker": turn["tiebreaker"],
+                "winner": turn["winner"],
+                "frames": frames,
+            },
         )
+        # Spectators are sent the whole turn in one frame.
+        self.state.broadcast(frames["turn"])
+
+    # This logic is called on both players when the current player has acknowledged their roll and it has been scored.
+    # A single group message carries the whole turn, and is followed straight away by the next step of the game,
+    # so each consumer only wakes up once per turn.
+    async def game_turn(self, event):
+        frames = event["frames"]
+        # Clients that opted in get the whole turn in one frame.
+        if self.coalesce:
+            await self.send_encoded(frames["turn"])
+        else:
+            # The other player is sent the current player's roll so they can display it however the client can.
+            if self.user.username != event["player"]:
+                await self.send_encoded(frames["roll"])
+            if frames["update"] is not None:
+                await self.send_encoded(frames["update"])
+
+        if event["winner"]:
+            await self.game_end({"tie": True})
+        elif event["tiebreaker"]:
+            await self.game_end_tie(None)
+        else:
+            await self.game_main(None)
 
     # This logic is run when the game ends normally, deciding a winner or runs the tiebreaker logic.
     # It is also called if the game ends in a tie but the tiebreaker has finished because this contains some of the same logic.
-    def game_end(self, event):
-        self.game.refresh_from_db()
+    async def game_end(self, event):
+        game = self.state
 
         # If this code isn't being called after finishing the tiebraker, we proceed as normal.
         if not event["tie"]:
             # The winner is decided from who has the higher score.
-            if self.game.player1_score > self.game.player2_score:
-                self.game.winner = self.game.players.first()
-                score = self.game.player1_score
-            elif self.game.player1_score < self.game.player2_score:
-                self.game.winner = self.game.players.last()
-                score = self.game.player2_score
+            if game.player1_score > game.player2_score:
+                game.winner = game.player1
+                score = game.player1_score
+            elif game.player1_score < game.player2_score:
+                game.winner = game.player2
+                score = game.player2_score
             # If the players, have the same score, the tiebraker code is triggered.
+            # The state is shared, so whichever consumer gets here first sets it up for both.
             else:
-                if not self.game.tiebreaker:
-                    self.game.tiebreaker = True
-                    self.game.player1_roll = 0
-                    self.game.player2_roll = 0
-                    self.game.current_player = self.game.players.first()
-                    self.game.save()
-                self.game_end_tie(None)
+                if not game.tiebreaker:
+                    game.tiebreaker = True
+                    game.player1_roll = 0
+                    game.player2_roll = 0
+                    game.current_player = game.player1
+                    await game.flush()
+                await self.game_end_tie(None)
                 return
         # If this code has been called after a tiebraker, we need to set the score for the later code.
         else:
-            score = max(
-                self.game.player1_score, self.game.player2_score
-            )  # they're the same anyway
+            score = max(game.player1_score, game.player2_score)  # they're the same anyway
+
+        frame = {
+            "message": "end",
+            "winner": game.winner.username,
+            "score": score,
+            "tie": event["tie"],
+        }
 
-        self.game.finished = True
-        self.game.save()
+        # The game is written back as soon as it is finished, and the spectators are sent the result and disconnected.
+        if not game.finished:
+            game.finished = True
+            game.broadcast(protocol.Encoded(frame), last=True)
+            await game.flush()
 
         # The winner is sent to both players.
-        self.send(
-            text_data=json.dumps(
-                {
-                    "message": "end",
-                    "winner": self.game.winner.username,
-                    "score": score,
-                    "tie": event["tie"],
-                }
-            )
-        )
+        await self.send_frame(frame)
 
-        self.close()
+        await self.close()
 
     # This logic is called if the game ends in a tie.
     # It runs very similar to the main game loop in that it generates a roll, waits for acknowledgement and rotates the players.
     # But it only generates one roll and checks if they're the same.
-    def game_end_tie(self, _event):
-        self.game.refresh_from_db()
+    async def game_end_tie(self, _event):
+        game = self.state
 
-        if not self.game.tiebreaker:
+        if not game.tiebreaker:
             return
 
-        if self.user != self.game.current_player:
+        if self.user.pk != game.current_player_id:
             return
 
+        is_player1 = game.current_player_id == game.player1.pk
+
         # If the current player has not rolled yet, we generate a roll and send it to them.
-        if (
-            self.game.current_player == self.game.players.first()
-            and not self.game.player1_roll
-        ) or (
-            self.game.current_player == self.game.players.last()
-            and not self.game.player2_roll
+        if (is_player1 and not game.player1_roll) or (
+            not is_player1 and not game.player2_roll
         ):
-            roll = [random.randint(1, 6)]
+            roll = rules.tiebreaker_roll(game.dice)
 
-            if self.game.current_player == self.game.players.first():
-                self.game.player1_roll = roll
+            if is_player1:
+                game.player1_roll = roll
             else:
-                self.game.player2_roll = roll
-
-            self.game.save()
-
-            self.send(
-                text_data=json.dumps(
-                    {
-                        "message": "your roll",
-                        "roll": roll,
-                        "double": False,
-                        "tiebreaker": True,
-                    }
-                )
+                game.player2_roll = roll
+            game.record(GameEvent.TIEBREAKER, 1 if is_player1 else 2, roll)
+
+            await self.send_frame(
+                {
+                    "message": "your roll",
+                    "roll": roll,
+                    "double": False,
+                    "tiebreaker": True,
+                }
             )
+            self.start_turn_timer()
 
             return
 
         # If the current player has rolled and acknowledged, we send the other player their roll.
 
-        if self.game.current_player == self.game.players.first():
-            roll = self.game.player1_roll
+        if is_player1:
+            roll = game.player1_roll
         else:
-            roll = self.game.player2_roll
+            roll = game.player2_roll
 
-        async_to_sync(self.channel_layer.group_send)(
-            self.game_group_name,
+        # If both players have rolled, we compare them and see if the tiebraker is over.
+        # Else, we switch the current player and call the tiebreaker logic again.
+        if game.player1_roll != 0 and game.player2_roll != 0:
+            winner = rules.tiebreaker_winner(game.player1_roll, game.player2_roll)
+            if winner:
+                game.winner = game.player1 if winner == 1 else game.player2
+            else:
+                game.player1_roll = 0
+                game.player2_roll = 0
+                game.current_player = game.player1
+        else:
+            game.current_player = game.player2 if is_player1 else game.player1
+
+        # The scores don't change in the tiebreaker, and the game ends once there is a winner (see game_turn).
+        await self.send_turn(
             {
-                "type": "game.pre_update",
-                "player": self.game.current_player.username,
+                "player": self.user.username,
                 "roll": roll,
                 "double": False,
                 "tiebreaker": True,
-            },
+                "round": game.round,
+                "score": None,
+                "player1_score": game.player1_score,
+                "player2_score": game.player2_score,
+                "next_player": None
+                if game.winner_id
+                else game.current_player.username,
+                "winner": game.winner.username if game.winner_id else None,
+                "player1_win_probability": None,
+                "player2_win_probability": None,
+            }
         )
 
-        # If both players have rolled, we compare them and see if the tiebraker is over.
-        # Else, we switch the current player and call the tiebreaker logic again.
-        if self.game.player1_roll != 0 and self.game.player2_roll != 0:
-            if self.game.player1_roll > self.game.player2_roll:
-                self.game.winner = self.game.players.first()
-                self.game.save()
-            elif self.game.player1_roll < self.game.player2_roll:
-                self.game.winner = self.game.players.last()
-                self.game.save()
-            else:
-                self.game.player1_roll = 0
-                self.game.player2_roll = 0
-                self.game.current_player = self.game.players.first()
-                self.game.save()
-                async_to_sync(self.channel_layer.group_send)(
-                    self.game_group_name,
-                    {
-                        "type": "game.end.tie",
-                    },
-                )
-                return
+    # This gives the player TURN_TIMEOUT seconds to acknowledge their roll.
+    # The deadlines of every game in this worker are tracked by a single timer wheel (see timeouts.py), rather than a task per connection.
+    def start_turn_timer(self):
+        wheel.arm(self.game_group_name, settings.TURN_TIMEOUT, self.turn_timeout)
 
-            async_to_sync(self.channel_layer.group_send)(
-                self.game_group_name,
-                {
-                    "type": "game.end",
-                    "tie": True,
-                },
-            )
+    # This logic is run when the player hasn't acknowledged their roll in time.
+    # They forfeit the game, so their opponent wins and the game is finished (and written back) like any other.
+    async def turn_timeout(self):
+        game = self.state
+        if game.finished or game.current_player_id != self.user.pk:
             return
 
-        self.game.current_player = self.game.players.exclude(
-            username=self.game.current_player.username
-        ).first()
-        self.game.save()
-
-        async_to_sync(self.channel_layer.group_send)(
+        game.winner = (
+            game.player2 if game.current_player_id == game.player1.pk else game.player1
+        )
+        game.finished = True
+        frame = protocol.Encoded(
+            {
+                "message": "end",
+                "winner": game.winner.username,
+                "score": game.player1_score
+                if game.winner_id == game.player1.pk
+                else game.player2_score,
+                "tie": False,
+            }
+        )
+        await self.channel_layer.group_send(
             self.game_group_name,
-            {"type": "game.end.tie"},
+            {"type": "game.forfeit", "player": self.user.username, "frame": frame},
         )
+        game.broadcast(frame, last=True)
+        await game.flush()
+
+    # This logic is run on both players when one of them has forfeited (see turn_timeout).
+    # The player who forfeited is told they timed out, and the winner is sent the result as if the game had ended normally.
+    async def game_forfeit(self, event):
+        if self.user.username == event["player"]:
+            await self.send_frame({"message": "timed out"})
+        else:
+            await self.send_encoded(event["frame"])
+        await self.close()
+
+    # This logic is run when no one has joined the game in WAITING_TIMEOUT seconds.
+    # The game is deleted and the player is disconnected.
+    async def waiting_timeout(self):
+        if len(self.state.connected) == 2:
+            return
+        await self.send_frame({"message": "no opponent"})
+        game_state.discard(self.state)
+        await self.delete_game()
+        await self.close()
+
+    # The following are the only places the consumer touches the database.
+    # Each one is a short synchronous section so a single thread hop covers several queries.
+
+    # This adds the user to the game's players and connected_players.
+    @database_sync_to_async
+    def join_game(self):
+        self.state.game.players.add(self.user)
+        self.state.game.connected_players.add(self.user)
+
+    # This removes the user from the connected_players list.
+    @database_sync_to_async
+    def leave_game(self):
+        self.state.game.connected_players.remove(self.user)
+
+    @database_sync_to_async
+    def delete_game(self):
+        Game.objects.filter(id=self.game_group_name).delete()
+
+
+class SpectatorConsumer(GameConsumer):
+    """
+    A read-only connection to a live game at ws/game/<id>/watch/, which any number of users can open.
+    Spectators aren't in the game's channel layer group and never touch the database once the game is loaded.
+    Instead, the players' consumers hand each frame (already encoded) to the GameState once, which puts it on every spectator's queue,
+    and a task per spectator writes its queue out.
+    The queues are bounded (see SPECTATOR_BUFFER), and a spectator that falls that far behind is disconnected rather than holding up the game.
+    """
+
+    async def connect(self):
+        self.subprotocol = protocol.negotiate(self.scope["subprotocols"])
+        self.writer = None
+
+        self.state = await game_state.acquire(self.scope["url_route"]["kwargs"]["id"])
+        if self.state is None:
+            await self.refuse("game does not exist")
+            return
+        if self.state.finished:
+            await self.refuse("game has finished")
+            return
+        if self.scope["user"].is_anonymous:
+            await self.refuse("unauthorised")
+            return
+
+        self.queue = asyncio.Queue(settings.SPECTATOR_BUFFER)
+        await self.accept(self.subprotocol)
+
+        # The spectator is first sent where the game is up to, then every frame from here on.
+        game = self.state
+        await self.send_frame(
+            {
+                "message": "watching",
+                "player1": game.player1.username if game.player1 else None,
+                "player2": game.player2.username if game.player2 else None,
+                "round": game.round,
+                "player1_score": game.player1_score,
+                "player2_score": game.player2_score,
+                "current_player": game.current_player.username
+                if game.current_player_id
+                else None,
+                "tiebreaker": game.tiebreaker,
+            }
+        )
+        game.spectators.add(self)
+        self.writer = asyncio.ensure_future(self.write())
+
+    async def disconnect(self, _code):
+        if not self.state:
+            return
+        self.state.spectators.discard(self)
+        if self.writer is not None:
+            self.writer.cancel()
+        game_state.release(self.state)
+
+    # Spectators can't play, so anything they send is ignored (but they are still throttled).
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.throttle()
+
+    # This queues a frame (wrapped in protocol.Encoded) to be sent to the spectator, or None to disconnect them once the queue has been sent.
+    # It never waits, so the players are never held up by a spectator.
+    def push(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.state.spectators.discard(self)
+            self.writer.cancel()
+            asyncio.ensure_future(self.close())
+
+    async def write(self):
+        while (frame := await self.queue.get()) is not None:
+            await self.send_encoded(frame)
+        await self.close()
@@ -0,0 +1,98 @@
+# Here, the dice for each game are defined.
+# Every game has its own seed, which is generated with a cryptographically secure RNG when the game is created and stored on the Game.
+# The rolls are drawn from a NumPy generator seeded with it, so the exact rolls of any game can be replayed afterwards (e.g. for disputes).
+# While a game is being played only a hash of the seed (the commitment) is shown, the seed itself is only revealed once the game has finished.
+
+import hashlib
+import secrets
+
+import numpy as np
+from django.conf import settings
+
+from . import rules
+
+# This is how many rolls are generated at a time, which avoids calling into NumPy for every single die.
+BLOCK_SIZE = 256
+
+
+# This generates a new 128-bit seed as a hex string.
+# If DICE_SEED is set (e.g. for load tests), the seed is instead derived from it and the game code, so every run is the same.
+def new_seed(game_id=None):
+    if settings.DICE_SEED is not None and game_id is not None:
+        return hashlib.sha256(f"{settings.DICE_SEED}:{game_id}".encode()).hexdigest()[
+            :32
+        ]
+    return secrets.token_hex(16)
+
+
+# This is the hash of a seed that players can see before the game has finished, to check the seed revealed afterwards against.
+def commitment(seed):
+    return hashlib.sha256(seed.encode()).hexdigest()
+
+
+class DiceStream:
+    """
+    The dice for a single game, drawn in order from a generator seeded with the game's seed.
+    Instances are callable and return a single die (1-6), so they can be passed straight to the rules engine.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.generator = np.random.Generator(np.random.PCG64(int(seed, 16)))
+        # This is how many dice have been rolled so far.
+        self.position = 0
+        self.block = []
+        self.index = 0
+
+    def __call__(self):
+        if self.index == len(self.block):
+            self.block = self.generator.integers(
+                1, rules.SIDES + 1, size=BLOCK_SIZE, dtype=np.int8
+            ).tolist()
+            self.index = 0
+        die = self.block[self.index]
+        self.index += 1
+        self.position += 1
+        return die
+
+
+# This replays the game that the supplied seed produces.
+# There are no choices in the game, so the rolls are always used in the same order:
+# each round player 1 then player 2 roll, followed by a tiebreaker (player 1 then player 2 each step) if the scores are level.
+def replay(seed):
+    dice = DiceStream(seed)
+    turns = []
+    scores = [0, 0]
+
+    for round_number in range(1, rules.ROUNDS + 1):
+        for player in (1, 2):
+            rolled = rules.roll(dice)
+            scores[player - 1] += rules.score(rolled)
+            turns.append(
+                {
+                    "round": round_number,
+                    "player": player,
+                    "roll": rolled,
+                    "score": scores[player - 1],
+                }
+            )
+
+    tiebreaker = []
+    if scores[0] > scores[1]:
+        winner = 1
+    elif scores[0] < scores[1]:
+        winner = 2
+    else:
+        winner = None
+        while not winner:
+            step = [rules.tiebreaker_roll(dice), rules.tiebreaker_roll(dice)]
+            tiebreaker.append(step)
+            winner = rules.tiebreaker_winner(*step)
+
+    return {
+        "turns": turns,
+        "tiebreaker": tiebreaker,
+        "player1_score": scores[0],
+        "player2_score": scores[1],
+        "winner": winner,
+    }
@@ -0,0 +1,124 @@
+# Here, a channel layer for running the game in a single process is defined.
+# Every game is a group of exactly two channels, so the generic InMemoryChannelLayer is more than we need:
+# it deep copies every message, and scans every channel and group for expired messages on every send and receive.
+# This layer keeps the same API (so the consumers work unchanged) but routes group messages straight onto each member's queue.
+# It only reaches consumers in its own process, so running several workers relies on run_cluster's router (see cluster.py),
+# which sends every connection for a game to the same worker.
+
+import asyncio
+import random
+import string
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+
+class PairChannelLayer(BaseChannelLayer):
+    """
+    In-process channel layer tuned for lots of small groups.
+    Each channel has a bounded queue (see capacity), and a group is just the list of its members' channel names,
+    so sending to a group costs one queue put per member.
+    Messages are not copied, so they must not be changed after they have been sent.
+    Messages that can't be delivered to a full channel are dropped (as with the other layers) and counted in stats().
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(capacity=capacity, channel_capacity=channel_capacity)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.channels = {}
+        # Each group maps its members' channel names to None, which is an insertion ordered set.
+        self.groups = {}
+        self.sent = 0
+        self.dropped = 0
+        self.deepest = 0
+
+    def queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(self.get_capacity(channel))
+        return queue
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.deliver(channel, message)
+
+    # This puts a message on a channel's queue without waiting, raising ChannelFull if it is at capacity.
+    def deliver(self, channel, message):
+        queue = self.queue(channel)
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            raise ChannelFull(channel)
+        self.sent += 1
+        if queue.qsize() > self.deepest:
+            self.deepest = queue.qsize()
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        queue = self.queue(channel)
+        try:
+            return await queue.get()
+        finally:
+            # Empty queues are dropped so channels that have gone away don't use any memory.
+            # The next send or receive on the channel makes a new one.
+            if queue.empty() and self.channels.get(channel) is queue:
+                del self.channels[channel]
+
+    async def new_channel(self, prefix="specific."):
+        return "%s.pair!%s" % (
+            prefix,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.groups.setdefault(group, {})[channel] = None
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.pop(channel, None)
+        if not members:
+            del self.groups[group]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        for channel in self.groups.get(group, ()):
+            try:
+                self.deliver(channel, message)
+            except ChannelFull:
+                self.dropped += 1
+
+    # Flush extension
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = {}
+
+    async def close(self):
+        pass
+
+    # This returns statistics about the layer, e.g. for monitoring how backed up the consumers are.
+    def stats(self):
+        depths = [queue.qsize() for queue in self.channels.values()]
+        return {
+            "channels": len(self.channels),
+            "groups": len(self.groups),
+            "queued": sum(depths),
+            "deepest_queue": max(depths, default=0),
+            "deepest_queue_ever": self.deepest,
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
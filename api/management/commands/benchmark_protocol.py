@@ -0,0 +1,167 @@
+# This command compares the JSON and binary wire formats (see api/protocol.py) over complete games.
+# The games are replayed from random seeds (see api/dice.py) into the frames each player would be sent, which are then encoded and decoded in both formats.
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import dice, odds, protocol, rules
+
+
+# This returns every frame the players of the game the seed produces would be sent, in order.
+# With coalesce, turns are sent as a single "turn" frame as they are with ?frames=turn.
+def game_frames(seed, usernames=("player1", "player2"), coalesce=False):
+    replay = dice.replay(seed)
+    scores = [0, 0]
+    frames = [
+        {"message": "waiting for another player"},
+        *[
+            {"message": "ready", "player1": usernames[0], "player2": usernames[1]}
+            for _ in usernames
+        ],
+    ]
+
+    def turn(
+        round_number, player, roll, tiebreaker, score, probabilities, winner=None
+    ):
+        name = usernames[player - 1]
+        frames.append(
+            {
+                "message": "your roll",
+                "roll": roll,
+                "double": rules.is_double(roll),
+                "tiebreaker": tiebreaker,
+            }
+        )
+        if coalesce:
+            frames.extend(
+                {
+                    "message": "turn",
+                    "player": name,
+                    "roll": roll,
+                    "double": rules.is_double(roll),
+                    "tiebreaker": tiebreaker,
+                    "round": round_number,
+                    "score": score,
+                    "player1_score": scores[0],
+                    "player2_score": scores[1],
+                    "next_player": None if winner else usernames[2 - player],
+                    "winner": winner,
+                    "player1_win_probability": probabilities[0],
+                    "player2_win_probability": probabilities[1],
+                }
+                for _ in usernames
+            )
+            return
+        frames.append(
+            {
+                "message": f"{name}'s roll",
+                "roll": roll,
+                "double": rules.is_double(roll),
+                "tiebreaker": tiebreaker,
+            }
+        )
+        if not tiebreaker:
+            frames.extend(
+                {
+                    "message": "update",
+                    "round": round_number,
+                    "player": name,
+                    "roll": roll,
+                    "score": score,
+                    "player1_win_probability": probabilities[0],
+                    "player2_win_probability": probabilities[1],
+                }
+                for _ in usernames
+            )
+
+    for played in replay["turns"]:
+        scores[played["player"] - 1] = played["score"]
+        probabilities = odds.win_probability(
+            played["round"], 3 - played["player"], *scores
+        )
+        turn(
+            played["round"],
+            played["player"],
+            played["roll"],
+            False,
+            played["score"],
+            probabilities,
+        )
+
+    # The tiebreaker is decided by player 2's roll in the last step.
+    for step, rolls in enumerate(replay["tiebreaker"], 1):
+        for player, roll in enumerate(rolls, 1):
+            winner = None
+            if step == len(replay["tiebreaker"]) and player == 2:
+                winner = usernames[replay["winner"] - 1]
+            turn(rules.ROUNDS, player, roll, True, None, (None, None), winner)
+
+    frames.extend(
+        {
+            "message": "end",
+            "winner": usernames[replay["winner"] - 1],
+            "score": max(scores),
+            "tie": bool(replay["tiebreaker"]),
+        }
+        for _ in usernames
+    )
+    return frames
+
+
+class Command(BaseCommand):
+    help = "Compares the size and encoding cost of the JSON and binary wire formats over complete games."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--games", type=int, default=10000, help="The number of games to replay."
+        )
+        parser.add_argument(
+            "--coalesce",
+            action="store_true",
+            help="Send each turn as a single frame, as with ?frames=turn.",
+        )
+
+    def handle(self, *args, **options):
+        if options["games"] < 1:
+            raise CommandError("--games must be positive.")
+        games = [
+            game_frames(dice.new_seed(), coalesce=options["coalesce"])
+            for _ in range(options["games"])
+        ]
+        count = sum(len(frames) for frames in games)
+
+        results = {}
+        for name, encode, decode in (
+            ("json", json.dumps, json.loads),
+            ("binary", protocol.encode, protocol.decode),
+        ):
+            start = time.perf_counter()
+            encoded = [[encode(frame) for frame in frames] for frames in games]
+            encode_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for frames in encoded:
+                for frame in frames:
+                    decode(frame)
+            decode_time = time.perf_counter() - start
+
+            # JSON frames are sent as text, which goes over the wire as UTF-8.
+            size = sum(
+                len(frame.encode() if isinstance(frame, str) else frame)
+                for frames in encoded
+                for frame in frames
+            )
+            results[name] = {
+                "bytes_per_game": size / len(games),
+                "bytes_per_frame": size / count,
+                "encode_microseconds_per_game": encode_time / len(games) * 1e6,
+                "decode_microseconds_per_game": decode_time / len(games) * 1e6,
+            }
+
+        results["frames_per_game"] = count / len(games)
+        results["binary_size_ratio"] = (
+            results["binary"]["bytes_per_game"] / results["json"]["bytes_per_game"]
+        )
+        self.stdout.write(json.dumps(results, indent=4))
@@ -0,0 +1,57 @@
+# This command rebuilds the leaderboard (see LeaderboardEntry) from the finished games, e.g. to backfill games finished before it existed.
+# The games are streamed in batches, so it runs in constant memory however many games there are.
+
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import Game, LeaderboardEntry
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the leaderboard from the finished games."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="The number of entries to insert at a time.",
+        )
+
+    def handle(self, *args, **options):
+        size = options["batch_size"]
+        if size < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        games = (
+            Game.objects.filter(finished=True)
+            .order_by()
+            .values_list(
+                "id",
+                "winner_id",
+                "player1_id",
+                "player1_score",
+                "player2_score",
+            )
+            .iterator(chunk_size=size)
+        )
+        entries = (
+            LeaderboardEntry(
+                game_id=id,
+                winner_id=winner_id,
+                score=player1_score if winner_id == player1_id else player2_score,
+            )
+            for id, winner_id, player1_id, player1_score, player2_score in games
+        )
+
+        count = 0
+        # The old entries are replaced in one transaction, so the leaderboard is never seen half built.
+        with transaction.atomic():
+            LeaderboardEntry.objects.all().delete()
+            while batch := list(islice(entries, size)):
+                LeaderboardEntry.objects.bulk_create(batch)
+                count += len(batch)
+
+        self.stdout.write(f"Rebuilt the leaderboard from {count} finished games.")
@@ -0,0 +1,67 @@
+# This command replays the exact rolls of a game from its dice seed (see dice.py), e.g. to settle a dispute.
+# The replay is checked against the rolls and scores recorded while the game was played (see GameEvent).
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import dice, rules
+from api.models import Game, GameEvent
+
+
+# This returns the events the supplied replay would have recorded, as (kind, round, player, roll, score), in order.
+def replay_events(replay):
+    events = []
+    for turn in replay["turns"]:
+        events.append(
+            (GameEvent.ROLL, turn["round"], turn["player"], turn["roll"], None)
+        )
+        events.append(
+            (
+                GameEvent.SCORE,
+                turn["round"],
+                turn["player"],
+                turn["roll"],
+                turn["score"],
+            )
+        )
+    for step in replay["tiebreaker"]:
+        for player, roll in enumerate(step, 1):
+            events.append((GameEvent.TIEBREAKER, rules.ROUNDS, player, roll, None))
+    return events
+
+
+class Command(BaseCommand):
+    help = "Replays the rolls of a game from its dice seed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("id", help="The game code.")
+
+    def handle(self, *args, **options):
+        try:
+            game = Game.objects.get(id=options["id"])
+        except Game.DoesNotExist:
+            raise CommandError("That game does not exist.")
+        if not game.dice_seed:
+            raise CommandError("That game was played before dice seeds were stored.")
+
+        replay = dice.replay(game.dice_seed)
+        replay["seed"] = game.dice_seed
+        replay["commitment"] = dice.commitment(game.dice_seed)
+        # A game that was forfeited (see DiceGameConsumer.turn_timeout) or is still being played stops part way through the replay,
+        # so only the events that were recorded are compared with it.
+        recorded = [
+            (event.kind, event.round, event.player, event.roll, event.score)
+            for event in game.events.all()
+        ]
+        if recorded:
+            replay["events"] = len(recorded)
+            replay["matches"] = recorded == replay_events(replay)[: len(recorded)]
+        # Games finished before events were recorded can only be checked against their final scores.
+        elif game.finished:
+            replay["matches"] = (
+                replay["player1_score"] == game.player1_score
+                and replay["player2_score"] == game.player2_score
+            )
+
+        self.stdout.write(json.dumps(replay, indent=4))
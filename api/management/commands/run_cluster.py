@@ -0,0 +1,110 @@
+# This command runs the game across several worker processes on one host (see api/cluster.py).
+# It starts a daphne worker per core, each listening on its own Unix domain socket, and the router in front of them.
+# Workers that exit are restarted, and sending the command SIGUSR1 adds another worker and rebalances the games across them.
+
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cluster import Router
+
+
+class Command(BaseCommand):
+    help = "Runs several game workers behind a router which sends each game to the same worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="The number of worker processes to start with (defaults to the number of cores).",
+        )
+        parser.add_argument(
+            "--bind", default="127.0.0.1", help="The address to listen on."
+        )
+        parser.add_argument(
+            "--port", type=int, default=8000, help="The port to listen on."
+        )
+        parser.add_argument(
+            "--replicas",
+            type=int,
+            default=128,
+            help="How many points each worker has on the hash ring.",
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be positive.")
+        with tempfile.TemporaryDirectory(prefix="dicegame-") as directory:
+            self.directory = directory
+            asyncio.run(self.run(options))
+
+    async def run(self, options):
+        self.router = Router(replicas=options["replicas"])
+        self.processes = {}
+        self.supervisors = []
+        for number in range(options["workers"]):
+            self.router.add_worker(*await self.start_worker(number))
+
+        server = await self.router.serve(options["bind"], options["port"])
+        self.stdout.write(
+            f"Routing {options['bind']}:{options['port']} to {options['workers']} workers "
+            f"(kill -USR1 {os.getpid()} to add a worker)."
+        )
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(
+            signal.SIGUSR1, lambda: loop.create_task(self.add_worker())
+        )
+        stop = asyncio.Event()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(stop_signal, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            for supervisor in self.supervisors:
+                supervisor.cancel()
+            for process in self.processes.values():
+                if process.returncode is None:
+                    process.terminate()
+                    await process.wait()
+
+    # This starts a new worker (restarted if it ever exits) and returns its name and socket path once it is listening.
+    async def start_worker(self, number):
+        name = f"worker{number}"
+        path = os.path.join(self.directory, f"{name}.sock")
+        await self.spawn(name, path)
+        self.supervisors.append(asyncio.ensure_future(self.supervise(name, path)))
+        return name, path
+
+    # This starts a worker process and waits for its socket to appear, so no connections are sent to it before it can take them.
+    async def spawn(self, name, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        process = self.processes[name] = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "daphne", "-u", path, "DiceGame.asgi:application"
+        )
+        while not os.path.exists(path):
+            if process.returncode is not None:
+                raise CommandError(f"{name} exited before it started listening.")
+            await asyncio.sleep(0.1)
+
+    # A restarted worker keeps its socket path, and so its place on the ring.
+    # The games that were being played in it are lost, just as if their players had disconnected.
+    async def supervise(self, name, path):
+        while True:
+            code = await self.processes[name].wait()
+            self.stderr.write(f"{name} exited with code {code}, restarting it.")
+            await self.spawn(name, path)
+
+    # Live games stay on the worker they are on until they are over, see Router.rebalance().
+    async def add_worker(self):
+        name, path = await self.start_worker(len(self.processes))
+        pinned = self.router.rebalance(name, path)
+        self.stdout.write(
+            f"Added {name}, {pinned} live games stay on their old worker until they are over."
+        )
@@ -0,0 +1,134 @@
+# This command plays lots of complete games (tiebreakers included) with the rules engine, so rule changes can be checked against large samples.
+# The games are split into batches which are played across all cores with a process pool.
+# A running summary is written out as each batch finishes, one JSON object per line.
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api import rules
+
+
+# This plays a single batch of games in a worker process and returns its aggregate results.
+# Only the aggregates are sent back to the main process, so a batch of a million games returns a few kilobytes.
+def play_batch(size, seed):
+    results = rules.play_games(size, np.random.default_rng(seed))
+    lengths = results["tiebreaker_length"]
+    return {
+        "games": size,
+        "player1_wins": int(np.count_nonzero(results["winner"] == 1)),
+        "ties": int(np.count_nonzero(lengths)),
+        "tiebreaker_steps": int(lengths.sum()),
+        "longest_tiebreaker": int(lengths.max(initial=0)),
+        "player1_scores": np.bincount(
+            results["player1_score"], minlength=rules.MAX_SCORE + 1
+        ),
+        "player2_scores": np.bincount(
+            results["player2_score"], minlength=rules.MAX_SCORE + 1
+        ),
+    }
+
+
+class Summary:
+    """
+    The running totals of a simulation, which batches are added into as they finish.
+    """
+
+    def __init__(self):
+        self.games = 0
+        self.player1_wins = 0
+        self.ties = 0
+        self.tiebreaker_steps = 0
+        self.longest_tiebreaker = 0
+        self.player1_scores = np.zeros(rules.MAX_SCORE + 1, dtype=np.int64)
+        self.player2_scores = np.zeros(rules.MAX_SCORE + 1, dtype=np.int64)
+
+    def add(self, batch):
+        self.games += batch["games"]
+        self.player1_wins += batch["player1_wins"]
+        self.ties += batch["ties"]
+        self.tiebreaker_steps += batch["tiebreaker_steps"]
+        self.longest_tiebreaker = max(
+            self.longest_tiebreaker, batch["longest_tiebreaker"]
+        )
+        self.player1_scores += batch["player1_scores"]
+        self.player2_scores += batch["player2_scores"]
+
+    def as_dict(self, total):
+        scores = self.player1_scores + self.player2_scores
+        return {
+            "games": self.games,
+            "done": self.games == total,
+            "player1_win_rate": self.player1_wins / self.games,
+            "tie_rate": self.ties / self.games,
+            "average_tiebreaker_length": self.tiebreaker_steps / self.ties
+            if self.ties
+            else 0,
+            "longest_tiebreaker": self.longest_tiebreaker,
+            "average_score": float(np.arange(scores.size) @ scores) / scores.sum(),
+            # The histograms are indexed by score, e.g. score_histogram[50] is how many times a player finished on 50.
+            "score_histogram": scores.tolist(),
+            "player1_score_histogram": self.player1_scores.tolist(),
+            "player2_score_histogram": self.player2_scores.tolist(),
+        }
+
+
+class Command(BaseCommand):
+    help = "Simulates complete games with the rules engine across all cores and reports aggregate results."
+
+    def add_arguments(self, parser):
+        parser.add_argument("games", type=int, help="The number of games to play.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="The number of worker processes (defaults to the number of cores).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=rules.CHUNK_SIZE,
+            help="The number of games each worker plays at a time.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=None,
+            help="Seeds the simulation so it can be repeated exactly.",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="A file to write the results to instead of stdout.",
+        )
+
+    def handle(self, *args, **options):
+        total = options["games"]
+        batch_size = options["batch_size"]
+        if total < 1 or batch_size < 1 or options["workers"] < 1:
+            raise CommandError("games, --workers and --batch-size must be positive.")
+
+        # Every batch gets its own independent seed from the root seed, so the results don't depend on which worker plays which batch.
+        sizes = [
+            min(batch_size, total - start) for start in range(0, total, batch_size)
+        ]
+        seeds = np.random.SeedSequence(options["seed"]).spawn(len(sizes))
+
+        output = open(options["output"], "w") if options["output"] else self.stdout
+        summary = Summary()
+        try:
+            with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+                batches = [
+                    pool.submit(play_batch, size, seed)
+                    for size, seed in zip(sizes, seeds)
+                ]
+                for batch in as_completed(batches):
+                    summary.add(batch.result())
+                    output.write(json.dumps(summary.as_dict(total)) + "\n")
+                    output.flush()
+        finally:
+            if output is not self.stdout:
+                output.close()
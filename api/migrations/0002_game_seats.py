@@ -0,0 +1,38 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_seats(apps, schema_editor):
+    # Existing games worked out the seats from the players list, so we copy that across.
+    Game = apps.get_model('api', 'Game')
+    for game in Game.objects.prefetch_related('players'):
+        players = sorted(game.players.all(), key=lambda user: user.pk)
+        if not players:
+            continue
+        game.player1 = players[0]
+        game.player2 = players[-1] if len(players) > 1 else None
+        game.save(update_fields=['player1', 'player2'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='player1',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='player2',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(fill_seats, migrations.RunPython.noop),
+    ]
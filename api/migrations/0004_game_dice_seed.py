@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='dice_seed',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
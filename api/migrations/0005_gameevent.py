@@ -0,0 +1,34 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_game_dice_seed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Roll'), (2, 'Score'), (3, 'Tiebreaker roll')])),
+                ('round', models.PositiveSmallIntegerField()),
+                ('player', models.PositiveSmallIntegerField()),
+                ('roll', models.JSONField(default=list)),
+                ('score', models.IntegerField(blank=True, null=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='api.game')),
+            ],
+            options={
+                'ordering': ['game', 'sequence'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='gameevent',
+            constraint=models.UniqueConstraint(fields=('game', 'sequence'), name='unique_game_event_sequence'),
+        ),
+    ]
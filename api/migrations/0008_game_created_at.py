@@ -0,0 +1,24 @@
+# Generated by Django 4.2.5 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_game_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['-created_at', '-id'], name='game_created'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Games created before created_at existed were all given the time of migration 0008.
+# Cursor pagination (see GameHistoryPagination) can only seek on created_at, and falls back to an OFFSET between games that share it,
+# so each of those games is given its own timestamp, a microsecond apart, in the order of their codes.
+
+import datetime
+
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_created_at(apps, schema_editor):
+    Game = apps.get_model("api", "Game")
+    shared = (
+        Game.objects.values("created_at")
+        .annotate(games=Count("id"))
+        .filter(games__gt=1)
+        .values_list("created_at", flat=True)
+    )
+    for created_at in list(shared):
+        ids = (
+            Game.objects.filter(created_at=created_at)
+            .order_by("-id")
+            .values_list("id", flat=True)
+        )
+        batch = []
+        # The games are spread back in time from the shared timestamp, so none of them move after games created later.
+        for offset, id in enumerate(ids.iterator(chunk_size=BATCH_SIZE)):
+            batch.append(
+                Game(
+                    id=id,
+                    created_at=created_at - datetime.timedelta(microseconds=offset),
+                )
+            )
+            if len(batch) == BATCH_SIZE:
+                Game.objects.bulk_update(batch, ["created_at"])
+                batch = []
+        Game.objects.bulk_update(batch, ["created_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_game_created_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+    ]
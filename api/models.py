@@ -17,6 +17,13 @@ class Game(models.Model):
     id = models.CharField(max_length=8, primary_key=True)
     # This contains a list of all the players (User models) in the game.
     players = models.ManyToManyField(User, related_name="games", blank=True)
+    # These are the players in each seat, so player 1 and player 2 can be loaded with the game in a single query.
+    player1 = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name="+", null=True, blank=True
+    )
+    player2 = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name="+", null=True, blank=True
+    )
     # This contains a list of all the players (User models) in the game that are currently connected via websockets.
     connected_players = models.ManyToManyField(
         User, related_name="connected_game", blank=True
@@ -40,3 +47,66 @@ class Game(models.Model):
     winner = models.ForeignKey(
         User, on_delete=models.SET_NULL, related_name="won_games", null=True
     )
+
+    # This is the seed the game's dice are rolled from (see dice.py), it lets the rolls of any game be replayed.
+    dice_seed = models.CharField(max_length=32, blank=True, default="")
+
+    # This is bumped every time the game is written to, so writers can tell if the row has changed since they last saw it.
+    version = models.PositiveIntegerField(default=0)
+    # This is when the game was last written to, it is sent as the Last-Modified header of the game's API responses.
+    updated_at = models.DateTimeField(auto_now=True)
+    # This is when the game was created, users' game histories are ordered by it (see UserViewSet.games).
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["-created_at", "-id"], name="game_created")]
+
+
+# This is the history of a game, one row for each roll, score and tiebreaker step in the order they happened.
+# The rows are buffered in memory during the game and inserted in bulk at round boundaries and when the game ends.
+class GameEvent(models.Model):
+    # These are the kinds of event that are recorded.
+    ROLL = 1
+    SCORE = 2
+    TIEBREAKER = 3
+    KINDS = [(ROLL, "Roll"), (SCORE, "Score"), (TIEBREAKER, "Tiebreaker roll")]
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name="events")
+    # This is the position of the event in the game's history, starting from 0.
+    sequence = models.PositiveIntegerField()
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    round = models.PositiveSmallIntegerField()
+    # This is the seat (1 or 2) of the player the event is for.
+    player = models.PositiveSmallIntegerField()
+    roll = models.JSONField(default=list)
+    # For score events, this is the player's total after the turn.
+    score = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["game", "sequence"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["game", "sequence"], name="unique_game_event_sequence"
+            )
+        ]
+
+
+# This is the leaderboard, one row for each finished game with the winning score.
+# It is written when a game finishes (see GameState.flush), so the top games can be read with one query over the score index
+# rather than sorting every finished game by both players' scores. It can be rebuilt with "python manage.py rebuild_leaderboard".
+class LeaderboardEntry(models.Model):
+    game = models.OneToOneField(
+        Game,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="leaderboard_entry",
+    )
+    winner = models.ForeignKey(
+        User, on_delete=models.SET_NULL, related_name="+", null=True
+    )
+    # This is the winner's score (in a tie, both players' score, and if their opponent forfeited, maybe the lower one).
+    score = models.IntegerField()
+
+    class Meta:
+        ordering = ["-score", "game"]
+        indexes = [models.Index(fields=["-score", "game"], name="leaderboard_score")]
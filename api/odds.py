@@ -0,0 +1,165 @@
+# Here, the exact odds of the dice game are calculated from the rules engine (see rules.py) rather than estimated by simulation.
+# The odds only depend on the rules, so they are calculated once, saved to disk and loaded when the server starts.
+
+import json
+
+import numpy as np
+from django.conf import settings
+
+from . import rules
+
+# This is bumped whenever the contents of the cache file change, so older caches are recalculated.
+CACHE_VERSION = 2
+
+# This holds the odds once they have been loaded, see load().
+_odds = None
+
+
+# This identifies the rules the odds were calculated for, so the cache is recalculated if the rules change.
+def rules_key():
+    return {
+        "rounds": rules.ROUNDS,
+        "sides": rules.SIDES,
+        "even_bonus": rules.EVEN_BONUS,
+        "odd_penalty": rules.ODD_PENALTY,
+    }
+
+
+# This returns the probability of scoring each number of points in a single turn, indexed by score.
+# Every possible roll is scored with the rules engine, the 3rd die only being rolled on a double.
+def turn_distribution():
+    probabilities = np.zeros(rules.MAX_TURN_SCORE + 1)
+    faces = range(1, rules.SIDES + 1)
+    for first in faces:
+        for second in faces:
+            if first != second:
+                probabilities[rules.score([first, second])] += 1 / rules.SIDES**2
+                continue
+            for third in faces:
+                probabilities[rules.score([first, second, third])] += (
+                    1 / rules.SIDES**3
+                )
+    return probabilities
+
+
+# This returns the probability of a player finishing on each total after the supplied number of turns, indexed by score.
+# Each turn is independent, so the distribution is the turn distribution convolved with itself once per turn.
+def score_distribution(turns=rules.ROUNDS):
+    turn = turn_distribution()
+    probabilities = np.ones(1)
+    for _ in range(turns):
+        probabilities = np.convolve(probabilities, turn)
+    return probabilities
+
+
+# This returns player 1's chance of winning for every score difference (player 1's score minus player 2's), indexed by difference + MAX_SCORE.
+# Each player has the supplied number of turns left, and a tie left at the end goes to the tiebreaker which either player wins half the time.
+def win_probabilities(player1_turns, player2_turns):
+    player1 = score_distribution(player1_turns)
+    player2 = score_distribution(player2_turns)
+
+    # This is the distribution of player 1's remaining points minus player 2's, where index player2.size - 1 is a difference of 0.
+    remaining = np.convolve(player1, player2[::-1])
+    zero = player2.size - 1
+    # at_least[i] is the probability of the remaining difference being at index i or above.
+    at_least = np.append(np.cumsum(remaining[::-1])[::-1], 0)
+
+    # Player 1 wins if they make up more than the current deficit, and ties if they make up exactly that.
+    differences = np.arange(-rules.MAX_SCORE, rules.MAX_SCORE + 1)
+    needed = zero - differences
+    beats = at_least[np.clip(needed + 1, 0, remaining.size)]
+    ties = np.where(
+        (needed >= 0) & (needed < remaining.size),
+        remaining[np.clip(needed, 0, remaining.size - 1)],
+        0,
+    )
+    # The probabilities are rounded so floating point error doesn't show up as e.g. a 1e-16 chance of winning.
+    return np.round(beats + ties / 2, 12)
+
+
+# This returns the win probability tables used during games, indexed by [round - 1][next player - 1][difference + MAX_SCORE].
+# The tables are looked up straight after a turn has been scored, which is either:
+# - player 1 has rolled in the round and player 2 is next, so player 2 has a turn more left than player 1, or
+# - player 2 has rolled in the round and player 1 is next, so they both have the same number of turns left.
+def win_probability_tables():
+    tables = []
+    for round in range(1, rules.ROUNDS + 1):
+        left = rules.ROUNDS - round
+        tables.append(
+            [
+                win_probabilities(left, left).tolist(),
+                win_probabilities(left, left + 1).tolist(),
+            ]
+        )
+    return tables
+
+
+# This calculates the odds of a whole game.
+def calculate():
+    turn = turn_distribution()
+    scores = score_distribution()
+
+    # Both players have the same distribution and roll independently.
+    # So player 1 wins in the normal rounds when player 2 finishes on any lower score.
+    tie = float(scores @ scores)
+    lower = np.cumsum(scores) - scores
+    player1_wins = float(scores @ lower)
+    player2_wins = 1 - tie - player1_wins
+
+    # Each step of the tiebreaker carries on if both players roll the same number, so its length is geometric.
+    # Once someone rolls higher, each player is equally likely to be the one who did.
+    step_tie = 1 / rules.SIDES
+
+    return {
+        "version": CACHE_VERSION,
+        "rules": rules_key(),
+        "turn_distribution": turn.tolist(),
+        "score_distribution": scores.tolist(),
+        "expected_score": float(np.arange(scores.size) @ scores),
+        "tiebreaker_probability": tie,
+        "expected_tiebreaker_length": 1 / (1 - step_tie),
+        "player1_win_probability": player1_wins + tie / 2,
+        "player2_win_probability": player2_wins + tie / 2,
+        "win_probability": win_probability_tables(),
+    }
+
+
+# This loads the odds from the cache file, recalculating (and re-saving) them if the file is missing or was made for different rules.
+def load(path=None):
+    global _odds
+
+    path = path or settings.ODDS_CACHE_PATH
+    try:
+        with open(path) as cache:
+            odds = json.load(cache)
+        if odds.get("version") != CACHE_VERSION or odds.get("rules") != rules_key():
+            odds = None
+    except (OSError, ValueError):
+        odds = None
+
+    if odds is None:
+        odds = calculate()
+        # The cache is only an optimisation, so we carry on if it can't be written (e.g. a read-only filesystem).
+        try:
+            with open(path, "w") as cache:
+                json.dump(odds, cache)
+        except OSError:
+            pass
+
+    _odds = odds
+    return odds
+
+
+# This returns the odds, loading them first if needed.
+def get():
+    return _odds if _odds is not None else load()
+
+
+# This returns each player's chance of winning straight after a turn has been scored, as (player 1, player 2).
+# It is a lookup into the precalculated tables, so it is cheap enough to do on every turn.
+def win_probability(round_number, next_player, player1_score, player2_score):
+    difference = player1_score - player2_score
+    player1 = get()["win_probability"][round_number - 1][next_player - 1][
+        difference + rules.MAX_SCORE
+    ]
+    return player1, round(1 - player1, 12)
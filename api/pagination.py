@@ -0,0 +1,16 @@
+from rest_framework import pagination
+
+
+class GameHistoryPagination(pagination.CursorPagination):
+    """
+    Cursor (keyset) pagination for users' game histories, newest first.
+    Each page starts from the position in the cursor rather than an offset, so later pages cost the same as the first
+    however many games the user has played. The ordering is covered by the game_created index.
+    Only created_at goes in the cursor, and games sharing one are paged through with an offset,
+    so every game has its own created_at (see migration 0009 for games created before it existed).
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -5,37 +5,50 @@ class UserPermission(permissions.BasePermission):
     """
     Custom permission class for the User viewset.
     Users cannot list all the accounts but they can view their account and other accounts.
-    Users can only update or delete their own account.
+    Users can only update or delete their own account, and list their own games.
     """
 
     def has_permission(self, request, view):
         if view.action == "create":
             return True
-        if view.action in ["retrieve", "partial_update", "destroy"]:
+        if view.action in ["retrieve", "partial_update", "destroy", "games"]:
             return request.user.is_authenticated
         return False
 
     def has_object_permission(self, request, view, obj):
-        if view.action in ["retrieve", "partial_update", "destroy"]:
+        if view.action in ["retrieve", "partial_update", "destroy", "games"]:
             return request.user == obj
         return False
 
 
+class OddsPermission(permissions.BasePermission):
+    """
+    Custom permission class for the Odds viewset.
+    Anyone can view the odds, they are read-only.
+    """
+
+    def has_permission(self, request, view):
+        return view.action == "list"
+
+
 class GamePermission(permissions.BasePermission):
     """
     Custom permission class for the Game viewset.
     Users can only view games they are a player in.
     These are only read-only.
+    Any user can get a ticket for connecting to a game's websockets, whether they are playing or watching.
     """
 
     def has_permission(self, request, view):
         if view.action in ["retrieve", "create"]:
             # return request.user.is_authenticated
             return True
+        if view.action == "ticket":
+            return request.user.is_authenticated
         return False
 
     def has_object_permission(self, request, view, obj):
-        if view.action == "create":
+        if view.action in ["create", "ticket"]:
             return request.user.is_authenticated
         if view.action in ["retrieve"]:
             # return request.user in obj.players.all()
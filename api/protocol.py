@@ -0,0 +1,309 @@
+# Here, the wire formats the game can be played over are defined.
+# JSON is the default (and what app/static/app/game.js uses), but clients can ask for a compact binary format instead
+# by offering the BINARY subprotocol when they connect (e.g. new WebSocket(url, ["dicegame.binary.v1"])).
+# Binary frames are sent as bytes and are a single message code byte followed by fixed-layout fields (see encode).
+
+import json
+import math
+import struct
+
+# This is the subprotocol clients offer to get binary frames.
+BINARY = "dicegame.binary.v1"
+
+# These are the message codes, the first byte of every binary frame.
+# Messages that only ever have the one form are just their code.
+WAITING = 1
+READY = 2
+YOUR_ROLL = 3
+OPPONENT_ROLL = 4
+UPDATE = 5
+TURN = 6
+END = 7
+NOT_YOUR_TURN = 8
+PLAYER_DISCONNECTED = 9
+TIMED_OUT = 10
+GAME_DOES_NOT_EXIST = 11
+GAME_HAS_FINISHED = 12
+UNAUTHORISED = 13
+WATCHING = 14
+GAME_IS_FULL = 15
+TOO_MANY_MESSAGES = 16
+NO_OPPONENT = 17
+
+SIMPLE_MESSAGES = {
+    "waiting for another player": WAITING,
+    "not your turn": NOT_YOUR_TURN,
+    "timed out": TIMED_OUT,
+    "game does not exist": GAME_DOES_NOT_EXIST,
+    "game has finished": GAME_HAS_FINISHED,
+    "unauthorised": UNAUTHORISED,
+    "game is full": GAME_IS_FULL,
+    "too many messages": TOO_MANY_MESSAGES,
+    "no opponent": NO_OPPONENT,
+}
+SIMPLE_CODES = {code: message for message, code in SIMPLE_MESSAGES.items()}
+
+# These are the bits of the flags byte.
+DOUBLE = 1
+TIEBREAKER = 2
+TIE = 4
+
+# A missing score is sent as this, and a missing probability as NaN.
+NO_SCORE = 0xFFFF
+
+# round, score, player 1's score, player 2's score, player 1's win probability, player 2's win probability
+TURN_FIELDS = struct.Struct("<BHHHff")
+# round, score, player 1's win probability, player 2's win probability
+UPDATE_FIELDS = struct.Struct("<BHff")
+# the winner's score
+END_FIELDS = struct.Struct("<H")
+# round, player 1's score, player 2's score
+WATCHING_FIELDS = struct.Struct("<BHH")
+# A string longer than 254 bytes has its length sent as 255 followed by this.
+LONG_STRING = struct.Struct("<H")
+
+
+# This returns the subprotocol to accept out of the ones the client offered, or None for JSON.
+def negotiate(subprotocols):
+    return BINARY if BINARY in subprotocols else None
+
+
+def flags(frame):
+    return (
+        (DOUBLE if frame.get("double") else 0)
+        | (TIEBREAKER if frame.get("tiebreaker") else 0)
+        | (TIE if frame.get("tie") else 0)
+    )
+
+
+# Strings (i.e. usernames) are their length followed by UTF-8, and a missing one is empty.
+# Usernames are nearly always short enough for the length to fit in a byte.
+def pack_string(value):
+    data = (value or "").encode()
+    if len(data) < 255:
+        return bytes([len(data)]) + data
+    return bytes([255]) + LONG_STRING.pack(len(data)) + data
+
+
+def pack_roll(roll):
+    return bytes([len(roll), *roll])
+
+
+def probability(value):
+    return math.nan if value is None else value
+
+
+# This encodes a frame (as it would be sent as JSON) in the binary format.
+def encode(frame):
+    message = frame["message"]
+    code = SIMPLE_MESSAGES.get(message)
+    if code is not None:
+        return bytes([code])
+    if message == "player disconnected":
+        return bytes([PLAYER_DISCONNECTED])
+    if message == "ready":
+        return (
+            bytes([READY])
+            + pack_string(frame["player1"])
+            + pack_string(frame["player2"])
+        )
+    if message == "your roll":
+        return bytes([YOUR_ROLL, flags(frame)]) + pack_roll(frame["roll"])
+    if message == "update":
+        return (
+            bytes([UPDATE])
+            + UPDATE_FIELDS.pack(
+                frame["round"],
+                frame["score"],
+                probability(frame["player1_win_probability"]),
+                probability(frame["player2_win_probability"]),
+            )
+            + pack_roll(frame["roll"])
+            + pack_string(frame["player"])
+        )
+    if message == "turn":
+        return (
+            bytes([TURN, flags(frame)])
+            + TURN_FIELDS.pack(
+                frame["round"],
+                NO_SCORE if frame["score"] is None else frame["score"],
+                frame["player1_score"],
+                frame["player2_score"],
+                probability(frame["player1_win_probability"]),
+                probability(frame["player2_win_probability"]),
+            )
+            + pack_roll(frame["roll"])
+            + pack_string(frame["player"])
+            + pack_string(frame["next_player"])
+            + pack_string(frame["winner"])
+        )
+    if message == "watching":
+        return (
+            bytes([WATCHING, flags(frame)])
+            + WATCHING_FIELDS.pack(
+                frame["round"], frame["player1_score"], frame["player2_score"]
+            )
+            + pack_string(frame["player1"])
+            + pack_string(frame["player2"])
+            + pack_string(frame["current_player"])
+        )
+    if message == "end":
+        return (
+            bytes([END, flags(frame)])
+            + END_FIELDS.pack(frame["score"])
+            + pack_string(frame["winner"])
+        )
+    # The only other message is the other player's roll, "<username>'s roll".
+    return (
+        bytes([OPPONENT_ROLL, flags(frame)])
+        + pack_roll(frame["roll"])
+        + pack_string(message[: -len("'s roll")])
+    )
+
+
+class Reader:
+    """
+    Reads the fields of a binary frame in order.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def byte(self):
+        self.offset += 1
+        return self.data[self.offset - 1]
+
+    def unpack(self, fields):
+        values = fields.unpack_from(self.data, self.offset)
+        self.offset += fields.size
+        return values
+
+    def string(self):
+        length = self.byte()
+        if length == 255:
+            (length,) = self.unpack(LONG_STRING)
+        self.offset += length
+        return self.data[self.offset - length : self.offset].decode() or None
+
+    def roll(self):
+        length = self.byte()
+        self.offset += length
+        return list(self.data[self.offset - length : self.offset])
+
+
+def unprobability(value):
+    return None if math.isnan(value) else value
+
+
+# This decodes a binary frame back into the frame it was encoded from, e.g. for bots written in Python and for tests.
+# Probabilities come back as 32-bit floats, so they are only accurate to about 7 digits.
+def decode(data):
+    reader = Reader(data)
+    code = reader.byte()
+    if code in SIMPLE_CODES:
+        return {"message": SIMPLE_CODES[code]}
+    if code == PLAYER_DISCONNECTED:
+        return {"message": "player disconnected", "abort": True}
+    if code == READY:
+        return {
+            "message": "ready",
+            "player1": reader.string(),
+            "player2": reader.string(),
+        }
+    if code == UPDATE:
+        round_number, score, player1, player2 = reader.unpack(UPDATE_FIELDS)
+        roll = reader.roll()
+        return {
+            "message": "update",
+            "round": round_number,
+            "player": reader.string(),
+            "roll": roll,
+            "score": score,
+            "player1_win_probability": unprobability(player1),
+            "player2_win_probability": unprobability(player2),
+        }
+
+    bits = reader.byte()
+    if code == YOUR_ROLL:
+        return {
+            "message": "your roll",
+            "roll": reader.roll(),
+            "double": bool(bits & DOUBLE),
+            "tiebreaker": bool(bits & TIEBREAKER),
+        }
+    if code == OPPONENT_ROLL:
+        roll = reader.roll()
+        return {
+            "message": f"{reader.string()}'s roll",
+            "roll": roll,
+            "double": bool(bits & DOUBLE),
+            "tiebreaker": bool(bits & TIEBREAKER),
+        }
+    if code == TURN:
+        (
+            round_number,
+            score,
+            player1_score,
+            player2_score,
+            player1,
+            player2,
+        ) = reader.unpack(TURN_FIELDS)
+        roll = reader.roll()
+        return {
+            "message": "turn",
+            "player": reader.string(),
+            "roll": roll,
+            "double": bool(bits & DOUBLE),
+            "tiebreaker": bool(bits & TIEBREAKER),
+            "round": round_number,
+            "score": None if score == NO_SCORE else score,
+            "player1_score": player1_score,
+            "player2_score": player2_score,
+            "next_player": reader.string(),
+            "winner": reader.string(),
+            "player1_win_probability": unprobability(player1),
+            "player2_win_probability": unprobability(player2),
+        }
+    if code == WATCHING:
+        round_number, player1_score, player2_score = reader.unpack(WATCHING_FIELDS)
+        return {
+            "message": "watching",
+            "player1": reader.string(),
+            "player2": reader.string(),
+            "round": round_number,
+            "player1_score": player1_score,
+            "player2_score": player2_score,
+            "current_player": reader.string(),
+            "tiebreaker": bool(bits & TIEBREAKER),
+        }
+    if code == END:
+        (score,) = reader.unpack(END_FIELDS)
+        return {
+            "message": "end",
+            "winner": reader.string(),
+            "score": score,
+            "tie": bool(bits & TIE),
+        }
+    raise ValueError(f"Unknown message code {code}.")
+
+
+class Encoded(dict):
+    """
+    A frame to be broadcast to consumers using either format (see DiceGameConsumer.send_turn), kept as {"frame": frame}.
+    Each format is only encoded the first time it is looked up (encoded["text"] or encoded["bytes"]), then kept for every other consumer.
+    It is a dict, so it can still pass through channel layers that serialise messages, in which case it is encoded again on the other side.
+    """
+
+    def __init__(self, frame):
+        super().__init__(frame=frame)
+
+    def __missing__(self, key):
+        if key == "text":
+            value = json.dumps(self["frame"])
+        elif key == "bytes":
+            value = encode(self["frame"])
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
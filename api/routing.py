@@ -1,7 +1,14 @@
+import re
+
 from django.urls import re_path
 
-from api.consumers import DiceGameConsumer
+from api.consumers import DiceGameConsumer, SpectatorConsumer
+
+# This matches the websocket paths of a game below, capturing the game code.
+# It is used by the things that need to know the game before the URL router has run (see TicketAuthMiddleware and cluster.Router).
+GAME_PATH = re.compile(r"^/ws/game/(?P<id>\w+)/")
 
 websocket_urlpatterns = [
     re_path(r"^ws/game/(?P<id>\w+)/$", DiceGameConsumer.as_asgi()),
+    re_path(r"^ws/game/(?P<id>\w+)/watch/$", SpectatorConsumer.as_asgi()),
 ]
@@ -0,0 +1,140 @@
+# Here, the rules of the dice game are defined, separately from Django so they can be used anywhere (e.g. simulations and balance analysis).
+# There is a scalar API, which the consumer uses to play a single turn, and a NumPy API which plays many games at once.
+#
+# The rules are:
+# - Each player rolls two dice per round. If they roll a double, they roll a third die which is added on.
+# - If the sum of the first two dice is even, 10 points are added, else 5 points are taken away (a turn can't score below 0).
+# - The game lasts 5 rounds and the player with the highest total wins.
+# - If the totals are the same, each player rolls a single die until one rolls higher than the other.
+
+import random
+
+import numpy as np
+
+ROUNDS = 5
+SIDES = 6
+EVEN_BONUS = 10
+ODD_PENALTY = 5
+
+# This is the most a single turn can score (a double of 6s followed by another 6) and so the most a player can score in a game.
+MAX_TURN_SCORE = 3 * SIDES + EVEN_BONUS
+MAX_SCORE = ROUNDS * MAX_TURN_SCORE
+
+# This is the largest number of games simulated in one go, which keeps the memory used by the NumPy API bounded.
+CHUNK_SIZE = 1_000_000
+
+
+# This rolls a single die using Python's random module, it is the default source of dice for the scalar API.
+def roll_die():
+    return random.randint(1, SIDES)
+
+
+# --- Scalar API ---
+
+
+# This rolls the dice for one turn. If it's a double, a 3rd roll is appended.
+# The dice can be any callable which returns a number from 1 to 6.
+def roll(dice=roll_die):
+    rolled = [dice(), dice()]
+    if rolled[0] == rolled[1]:
+        rolled.append(dice())
+    return rolled
+
+
+def is_double(rolled):
+    return len(rolled) >= 2 and rolled[0] == rolled[1]
+
+
+# This calculates the score for a turn from its roll.
+def score(rolled):
+    points = sum(rolled)
+
+    # If the first two dice add up to an even number we add 10 points, else we subtract 5.
+    if sum(rolled[:2]) % 2 == 0:
+        points += EVEN_BONUS
+    else:
+        points -= ODD_PENALTY
+
+    # If the score is negative, we set it to 0.
+    return max(points, 0)
+
+
+# This rolls the single die used for each step of the tiebreaker.
+def tiebreaker_roll(dice=roll_die):
+    return [dice()]
+
+
+# This compares two tiebreaker rolls, returning the winning player (1 or 2) or None if they need to roll again.
+def tiebreaker_winner(player1_roll, player2_roll):
+    if player1_roll > player2_roll:
+        return 1
+    if player1_roll < player2_roll:
+        return 2
+    return None
+
+
+# --- NumPy API ---
+
+
+# This calculates the score for an array of rolls with shape (..., 3).
+# The 3rd die is only counted where the first two are a double, so it can be rolled unconditionally.
+def score_rolls(rolls):
+    first, second, third = rolls[..., 0], rolls[..., 1], rolls[..., 2]
+    pair = first + second
+    points = pair + np.where(first == second, third, 0)
+    points += np.where(pair % 2 == 0, EVEN_BONUS, -ODD_PENALTY)
+    return np.maximum(points, 0)
+
+
+# This plays the 5 rounds of n games, returning two arrays with each player's total score.
+def play_rounds(n, rng, rounds=ROUNDS):
+    rolls = rng.integers(1, SIDES + 1, size=(n, 2, rounds, 3), dtype=np.int16)
+    totals = score_rolls(rolls).sum(axis=-1, dtype=np.int32)
+    return totals[:, 0], totals[:, 1]
+
+
+# This plays n tiebreakers, returning the winner of each (1 or 2) and how many steps each one took.
+# Each step both players roll one die, and only the tiebreakers that are still level roll again.
+def play_tiebreakers(n, rng):
+    winners = np.zeros(n, dtype=np.int8)
+    lengths = np.zeros(n, dtype=np.int32)
+    undecided = np.arange(n)
+    while undecided.size:
+        rolls = rng.integers(1, SIDES + 1, size=(undecided.size, 2), dtype=np.int8)
+        lengths[undecided] += 1
+        winners[undecided] = np.where(
+            rolls[:, 0] > rolls[:, 1], 1, np.where(rolls[:, 0] < rolls[:, 1], 2, 0)
+        )
+        undecided = undecided[winners[undecided] == 0]
+    return winners, lengths
+
+
+# This plays n complete games (tiebreakers included) and returns a dictionary of arrays:
+# player1_score, player2_score, winner (1 or 2) and tiebreaker_length (0 if there was no tiebreaker).
+# Games are played in chunks so millions can be simulated without running out of memory.
+def play_games(n, rng=None, rounds=ROUNDS):
+    rng = rng if rng is not None else np.random.default_rng()
+
+    results = {
+        "player1_score": np.empty(n, dtype=np.int32),
+        "player2_score": np.empty(n, dtype=np.int32),
+        "winner": np.empty(n, dtype=np.int8),
+        "tiebreaker_length": np.zeros(n, dtype=np.int32),
+    }
+
+    for start in range(0, n, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, n)
+        player1, player2 = play_rounds(stop - start, rng, rounds)
+        winner = np.where(player1 > player2, 1, 2).astype(np.int8)
+
+        tied = np.flatnonzero(player1 == player2)
+        if tied.size:
+            tiebreaker_winners, lengths = play_tiebreakers(tied.size, rng)
+            winner[tied] = tiebreaker_winners
+            results["tiebreaker_length"][start + tied] = lengths
+
+        results["player1_score"][start:stop] = player1
+        results["player2_score"][start:stop] = player2
+        results["winner"][start:stop] = winner
+
+    return results
@@ -3,14 +3,16 @@ import string
 
 from rest_framework import serializers as serialisers  # love being British
 
+from . import dice
 from .models import Game, User
 
 
 class UserSerialiser(serialisers.ModelSerializer):
     class Meta:
         model = User
-        fields = ["id", "username", "password", "games"]
-        read_only_fields = ["id", "games"]
+        # Users' games are listed a page at a time by UserViewSet.games, rather than all of them being embedded here.
+        fields = ["id", "username", "password"]
+        read_only_fields = ["id"]
         extra_kwargs = {"password": {"write_only": True}}
 
     def create(self, validated_data):
@@ -18,7 +20,32 @@ class UserSerialiser(serialisers.ModelSerializer):
         return user
 
 
+class GameSummarySerialiser(serialisers.ModelSerializer):
+    # The players and winner are shown by username, they should be prefetched with the games (see UserViewSet.games).
+    players = serialisers.SlugRelatedField(
+        many=True, read_only=True, slug_field="username"
+    )
+    winner = serialisers.SlugRelatedField(read_only=True, slug_field="username")
+
+    class Meta:
+        model = Game
+        fields = [
+            "id",
+            "players",
+            "player1_score",
+            "player2_score",
+            "finished",
+            "winner",
+            "created_at",
+        ]
+        read_only_fields = fields
+
+
 class GameSerialiser(serialisers.ModelSerializer):
+    # The dice seed is kept secret until the game has finished, but its hash is shown so players can check it afterwards.
+    dice_commitment = serialisers.SerializerMethodField()
+    dice_seed = serialisers.SerializerMethodField()
+
     # players = serialisers.PrimaryKeyRelatedField(
     #     many=True, queryset=User.objects, allow_null=False
     # )
@@ -28,28 +55,41 @@ class GameSerialiser(serialisers.ModelSerializer):
         fields = [
             "id",
             "players",
+            "player1",
+            "player2",
             "player1_score",
             "player2_score",
             "finished",
             "winner",
+            "dice_commitment",
+            "dice_seed",
         ]
         read_only_fields = [
             "id",
             "players",
+            "player1",
+            "player2",
             "player1_score",
             "player2_score",
             "finished",
             "winner",
         ]
 
+    def get_dice_commitment(self, game):
+        return dice.commitment(game.dice_seed) if game.dice_seed else None
+
+    def get_dice_seed(self, game):
+        return game.dice_seed if game.finished else None
+
     def create(self, validated_data):
         id = "".join(random.choices(string.digits, k=6))  # Output is like as 'XDCxVAJl'
 
         #     # validated_data["player1"] = validated_data["players"][0]
         #     # validated_data["player2"] = validated_data["players"][1]
 
-        game = Game.objects.create(id=id)
+        # The user creating the game takes the first seat.
+        game = Game.objects.create(
+            id=id, player1=validated_data["user"], dice_seed=dice.new_seed(id)
+        )
         game.players.add(validated_data["user"])
-        game.save()
-        game.refresh_from_db()
         return game
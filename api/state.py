@@ -0,0 +1,271 @@
+# Here, the in-memory state of each live game is defined.
+# The worker that hosts a game keeps a single GameState for it which both consumers share, so turns never wait on the database.
+# The Game row is only written back (flushed) at round boundaries, when the game ends and when a player disconnects.
+# Every roll, score and tiebreaker step is recorded as a GameEvent, these are buffered and inserted in bulk when flushing.
+
+from channels.db import database_sync_to_async
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from . import caching
+from .dice import DiceStream, new_seed
+from .models import Game, GameEvent, LeaderboardEntry
+
+# These are the Game columns that are mirrored in memory and written back when flushing.
+FIELDS = [
+    "player1_roll",
+    "player2_roll",
+    "player1_score",
+    "player2_score",
+    "round",
+    "current_player_id",
+    "tiebreaker",
+    "finished",
+    "winner_id",
+    "dice_seed",
+]
+
+# This holds the state of every live game hosted by this worker, keyed by the game code.
+games = {}
+
+
+class GameState:
+    """
+    The authoritative in-memory state of a live game.
+    Consumers mutate this object directly and flush() writes any columns that changed back to the Game row.
+    """
+
+    def __init__(self, game):
+        # The model instance is kept so its relations (players, connected_players) can be updated.
+        self.game = game
+        self.id = game.id
+        # This is the version of the row we last wrote or loaded, it is used to detect other writers (see flush).
+        self.version = game.version
+        for field in FIELDS:
+            setattr(self, field, getattr(game, field))
+
+        # These are the User models in each seat, they are filled in as the players join.
+        self.player1 = game.player1
+        self.player2 = game.player2
+
+        # This contains the primary keys of the players that are currently connected via websockets.
+        self.connected = set()
+        # This is the number of consumers in this worker using the state, it is dropped from the registry at zero.
+        self.consumers = 0
+        # These are the consumers of the users watching the game (see SpectatorConsumer).
+        self.spectators = set()
+
+        self._persisted = self.snapshot()
+
+        # These are the events that haven't been written yet, and the number of events recorded so far.
+        self.events = []
+        self.event_count = game.event_count
+
+        # Games created before seeds were stored are given one now, it is written back with the next flush.
+        if not self.dice_seed:
+            self.dice_seed = new_seed(self.id)
+        self.dice = DiceStream(self.dice_seed)
+
+    def snapshot(self):
+        values = {field: getattr(self, field) for field in FIELDS}
+        values["player1_id"] = self.player1.pk if self.player1 else None
+        values["player2_id"] = self.player2.pk if self.player2 else None
+        return values
+
+    # This returns which seat (1 or 2) the supplied user is in, or None if they don't have one.
+    def seat(self, user):
+        if self.player1 and self.player1.pk == user.pk:
+            return 1
+        if self.player2 and self.player2.pk == user.pk:
+            return 2
+        return None
+
+    # This gives the supplied user the first free seat, returning the seat number (or None if the game is full).
+    def take_seat(self, user):
+        seat = self.seat(user)
+        if seat:
+            return seat
+        if not self.player1:
+            self.player1 = user
+            return 1
+        if not self.player2:
+            self.player2 = user
+            return 2
+        return None
+
+    # This returns the columns that have changed since the last flush.
+    def changes(self):
+        return {
+            field: value
+            for field, value in self.snapshot().items()
+            if value != self._persisted[field]
+        }
+
+    # This returns the User model of the player whose turn it is.
+    @property
+    def current_player(self):
+        if self.player1 and self.current_player_id == self.player1.pk:
+            return self.player1
+        return self.player2
+
+    @current_player.setter
+    def current_player(self, user):
+        self.current_player_id = user.pk if user else None
+
+    # This returns the User model of the winner (if there is one).
+    @property
+    def winner(self):
+        if self.player1 and self.winner_id == self.player1.pk:
+            return self.player1
+        return self.player2 if self.winner_id else None
+
+    @winner.setter
+    def winner(self, user):
+        self.winner_id = user.pk if user else None
+
+    # This sends a frame (wrapped in protocol.Encoded) to every spectator.
+    # With last, the spectators are disconnected once it has been sent, as the game is over.
+    def broadcast(self, frame, last=False):
+        for spectator in list(self.spectators):
+            spectator.push(frame)
+            if last:
+                spectator.push(None)
+        if last:
+            self.spectators.clear()
+
+    # This records an event in the game's history, it is written with the next flush.
+    def record(self, kind, player, roll, score=None):
+        self.events.append(
+            GameEvent(
+                game_id=self.id,
+                sequence=self.event_count,
+                kind=kind,
+                round=self.round,
+                player=player,
+                roll=roll,
+                score=score,
+            )
+        )
+        self.event_count += 1
+
+    # This replaces the state's columns with the ones in the Game row, dropping any changes and events that haven't been written.
+    async def reload(self):
+        game = await fetch_game(self.id)
+        if game is None:
+            return
+        self.game = game
+        self.version = game.version
+        for field in FIELDS:
+            setattr(self, field, getattr(game, field))
+        self.player1 = game.player1
+        self.player2 = game.player2
+        self.dice_seed = self.dice_seed or self.dice.seed
+        self._persisted = self.snapshot()
+        self.events = []
+        self.event_count = game.event_count
+
+    # This writes any changed columns back to the Game row in a single UPDATE, and inserts any buffered events in bulk.
+    # The changes are collected before handing over to the database thread, so turns played during the write are not lost.
+    # The flush that finishes the game also adds it to the leaderboard.
+    # The UPDATE only applies if the row is still at the version we last saw. If anyone else has written to it since,
+    # their write wins: ours is rejected and the state is reloaded from the row. True is returned if the write was made.
+    async def flush(self):
+        changes = self.changes()
+        events, self.events = self.events, []
+        if not changes and not events:
+            return True
+
+        if not changes:
+            await write_events(self.id, events)
+            return True
+
+        entry = None
+        if changes.get("finished"):
+            # The winner usually has the higher score, but not if their opponent forfeited (see DiceGameConsumer.turn_timeout).
+            entry = LeaderboardEntry(
+                game_id=self.id,
+                winner_id=self.winner_id,
+                score=self.player1_score
+                if self.winner is self.player1
+                else self.player2_score,
+            )
+
+        # The state is marked as written before handing over, so a flush made while this one is running writes on top of it.
+        version = self.version
+        self.version += 1
+        self._persisted.update(changes)
+        if not await write_game(self.id, version, changes, events, entry):
+            await self.reload()
+            return False
+        # The cached leaderboard may now be out of date.
+        if entry is not None:
+            await caching.game_finished(self.id)
+        return True
+
+
+# This writes the supplied values to the Game row if it is still at the supplied version, bumping the version.
+# The events (and the leaderboard entry, if there is one) are written in the same transaction.
+# False is returned (and nothing is written) if the row has moved on or no longer exists.
+@database_sync_to_async
+def write_game(game_id, version, values, events, entry=None):
+    with transaction.atomic():
+        if not Game.objects.filter(id=game_id, version=version).update(
+            version=F("version") + 1, updated_at=timezone.now(), **values
+        ):
+            return False
+        GameEvent.objects.bulk_create(events)
+        if entry is not None:
+            entry.save()
+        return True
+
+
+# This inserts the supplied events in bulk, unless the game has been deleted (e.g. it was aborted).
+@database_sync_to_async
+def write_events(game_id, events):
+    with transaction.atomic():
+        if Game.objects.filter(id=game_id).exists():
+            GameEvent.objects.bulk_create(events)
+
+
+@database_sync_to_async
+def fetch_game(game_id):
+    return (
+        Game.objects.select_related("player1", "player2")
+        .annotate(event_count=Count("events"))
+        .filter(id=game_id)
+        .first()
+    )
+
+
+async def load_game(game_id):
+    game = await fetch_game(game_id)
+    if game is None:
+        return None
+    return GameState(game)
+
+
+# This returns the state of the supplied game, loading it from the database if this worker isn't hosting it yet.
+# None is returned if the game does not exist.
+async def acquire(game_id):
+    state = games.get(game_id)
+    if state is None:
+        loaded = await load_game(game_id)
+        if loaded is None:
+            return None
+        # Another consumer may have loaded the game while we were waiting, in which case we use theirs.
+        state = games.setdefault(game_id, loaded)
+    state.consumers += 1
+    return state
+
+
+# This is called when a consumer is done with a game, the state is dropped once no consumers are using it.
+def release(state):
+    state.consumers -= 1
+    if state.consumers <= 0 and games.get(state.id) is state:
+        del games[state.id]
+
+
+# This drops a game from the registry straight away (e.g. when it has been deleted).
+def discard(state):
+    if games.get(state.id) is state:
+        del games[state.id]
@@ -1,3 +1,990 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import auth, caching, dice, odds, permissions, protocol, rules, state
+from .cluster import HashRing, Router
+from .consumers import SpectatorConsumer
+from .layers import PairChannelLayer
+from .models import Game, GameEvent, LeaderboardEntry, User
+from .routing import websocket_urlpatterns
+from .throttling import TokenBucket
+from .timeouts import TimerWheel
+
+
+class GameStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="player1", password="password")
+        Game.objects.create(id="123456", player1=self.user, dice_seed="0" * 32)
+        self.state = async_to_sync(state.load_game)("123456")
+
+    def test_flush_writes_changes_and_bumps_version(self):
+        self.state.round = 2
+        self.assertTrue(async_to_sync(self.state.flush)())
+        game = Game.objects.get(id="123456")
+        self.assertEqual((game.round, game.version), (2, 1))
+        self.assertEqual(self.state.version, 1)
+
+    def test_flush_rejects_changes_if_someone_else_wrote(self):
+        Game.objects.filter(id="123456").update(version=F("version") + 1, round=3)
+        self.state.round = 2
+        self.state.player1_score = 10
+        self.assertFalse(async_to_sync(self.state.flush)())
+        game = Game.objects.get(id="123456")
+        self.assertEqual((game.round, game.player1_score, game.version), (3, 0, 1))
+        # The state carries on from what the other writer wrote.
+        self.assertEqual((self.state.round, self.state.player1_score), (3, 0))
+        self.state.round = 4
+        self.assertTrue(async_to_sync(self.state.flush)())
+        self.assertEqual(Game.objects.get(id="123456").round, 4)
+
+
+# This returns a callable that rolls the supplied dice in order, for passing to the rules engine.
+def loaded_dice(*faces):
+    return iter(faces).__next__
+
+
+class RulesTests(SimpleTestCase):
+    def test_score(self):
+        # An even pair scores 10 more than its dice, an odd pair 5 less (but never below 0).
+        self.assertEqual(rules.score([2, 4]), 16)
+        self.assertEqual(rules.score([5, 6]), 6)
+        self.assertEqual(rules.score([1, 2]), 0)
+        # The third die of a double is added on.
+        self.assertEqual(rules.score([3, 3, 4]), 20)
+        self.assertEqual(rules.score([6, 6, 6]), rules.MAX_TURN_SCORE)
+
+    def test_roll(self):
+        self.assertEqual(rules.roll(loaded_dice(1, 2, 6)), [1, 2])
+        self.assertEqual(rules.roll(loaded_dice(3, 3, 5)), [3, 3, 5])
+        self.assertTrue(rules.is_double([3, 3, 5]))
+        self.assertFalse(rules.is_double([1, 2]))
+
+    def test_tiebreaker_winner(self):
+        self.assertEqual(rules.tiebreaker_winner([6], [2]), 1)
+        self.assertEqual(rules.tiebreaker_winner([2], [6]), 2)
+        self.assertIsNone(rules.tiebreaker_winner([4], [4]))
+
+    def test_numpy_scores_match_scalar_scores(self):
+        rolls = np.array(list(itertools.product(range(1, rules.SIDES + 1), repeat=3)))
+        expected = [
+            rules.score(list(roll) if roll[0] == roll[1] else list(roll[:2]))
+            for roll in rolls
+        ]
+        self.assertEqual(rules.score_rolls(rolls).tolist(), expected)
+
+    def test_play_games(self):
+        results = rules.play_games(10000, np.random.default_rng(1))
+        player1, player2 = results["player1_score"], results["player2_score"]
+        winners = results["winner"]
+        self.assertTrue(np.all(winners[player1 > player2] == 1))
+        self.assertTrue(np.all(winners[player1 < player2] == 2))
+        # Only tied games have a tiebreaker, and every tiebreaker has a winner.
+        tied = player1 == player2
+        self.assertTrue(np.all(results["tiebreaker_length"][tied] > 0))
+        self.assertTrue(np.all(results["tiebreaker_length"][~tied] == 0))
+        self.assertTrue(np.all(np.isin(winners, [1, 2])))
+
+
+class OddsTests(SimpleTestCase):
+    def test_distributions_sum_to_one(self):
+        self.assertAlmostEqual(odds.turn_distribution().sum(), 1)
+        self.assertAlmostEqual(odds.score_distribution().sum(), 1)
+
+    def test_calculate_matches_simulation(self):
+        calculated = odds.calculate()
+        # The players are symmetric, so each wins half the time.
+        self.assertAlmostEqual(calculated["player1_win_probability"], 0.5)
+        self.assertAlmostEqual(calculated["player2_win_probability"], 0.5)
+
+        results = rules.play_games(200000, np.random.default_rng(1))
+        self.assertAlmostEqual(
+            results["player1_score"].mean(), calculated["expected_score"], delta=0.2
+        )
+        tie_rate = np.count_nonzero(results["tiebreaker_length"]) / 200000
+        self.assertAlmostEqual(
+            tie_rate, calculated["tiebreaker_probability"], delta=0.002
+        )
+
+    def test_win_probability_after_the_last_turn(self):
+        # After player 2's last turn, the game is decided (or goes to a tiebreaker either player is as likely to win).
+        self.assertEqual(odds.win_probability(rules.ROUNDS, 1, 50, 40), (1.0, 0.0))
+        self.assertEqual(odds.win_probability(rules.ROUNDS, 1, 40, 50), (0.0, 1.0))
+        self.assertEqual(odds.win_probability(rules.ROUNDS, 1, 40, 40), (0.5, 0.5))
+
+
+class DiceTests(SimpleTestCase):
+    def test_replay_is_repeatable(self):
+        seed = dice.new_seed()
+        self.assertEqual(dice.replay(seed), dice.replay(seed))
+        self.assertNotEqual(dice.replay(seed), dice.replay(dice.new_seed()))
+
+    def test_replay_follows_the_rules(self):
+        seed = "0123456789abcdef0123456789abcdef"
+        replay = dice.replay(seed)
+        self.assertEqual(len(replay["turns"]), 2 * rules.ROUNDS)
+
+        # The rolls are drawn from the game's dice in order, as they are during a game.
+        stream = dice.DiceStream(seed)
+        scores = [0, 0]
+        for turn in replay["turns"]:
+            self.assertEqual(turn["roll"], rules.roll(stream))
+            scores[turn["player"] - 1] += rules.score(turn["roll"])
+            self.assertEqual(turn["score"], scores[turn["player"] - 1])
+        self.assertEqual([replay["player1_score"], replay["player2_score"]], scores)
+        if scores[0] != scores[1]:
+            self.assertEqual(replay["winner"], 1 if scores[0] > scores[1] else 2)
+            self.assertEqual(replay["tiebreaker"], [])
+
+    def test_commitment(self):
+        seed = dice.new_seed()
+        self.assertEqual(dice.commitment(seed), dice.commitment(seed))
+        self.assertNotIn(seed, dice.commitment(seed))
+
+
+class ReplayGameTests(TestCase):
+    SEED = "0123456789abcdef0123456789abcdef"
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="player1", password="password")
+        self.other = User.objects.create_user(username="player2", password="password")
+        # The game is forfeited by player 2 after player 1's first turn, so it stops long before the replay does.
+        self.game = Game.objects.create(
+            id="123456",
+            player1=self.user,
+            player2=self.other,
+            dice_seed=self.SEED,
+            finished=True,
+            winner=self.user,
+        )
+        first, second = dice.replay(self.SEED)["turns"][:2]
+        self.game.player1_score = first["score"]
+        self.game.save()
+        for sequence, (kind, turn, score) in enumerate(
+            [
+                (GameEvent.ROLL, first, None),
+                (GameEvent.SCORE, first, first["score"]),
+                (GameEvent.ROLL, second, None),
+            ]
+        ):
+            GameEvent.objects.create(
+                game=self.game,
+                sequence=sequence,
+                kind=kind,
+                round=1,
+                player=turn["player"],
+                roll=turn["roll"],
+                score=score,
+            )
+
+    def replay(self):
+        output = StringIO()
+        call_command("replay_game", "123456", stdout=output)
+        return json.loads(output.getvalue())
+
+    def test_forfeited_game_matches_its_events(self):
+        replay = self.replay()
+        self.assertEqual(replay["events"], 3)
+        self.assertTrue(replay["matches"])
+
+    def test_changed_roll_does_not_match(self):
+        event = GameEvent.objects.get(game=self.game, sequence=2)
+        event.roll = [7]
+        event.save()
+        self.assertFalse(self.replay()["matches"])
+
+
+class TimerWheelTests(SimpleTestCase):
+    def test_timers_fire_in_order(self):
+        asyncio.run(self.run_timers())
+
+    async def run_timers(self):
+        wheel = TimerWheel(tick=0.01, slots=8)
+        fired = []
+
+        def timer(key):
+            async def callback():
+                fired.append(key)
+
+            return callback
+
+        # The last timer is longer than a full turn of the wheel.
+        for key, delay in (("a", 0.05), ("b", 0.02), ("c", 0.03), ("d", 0.15)):
+            wheel.arm(key, delay, timer(key))
+        wheel.cancel("c")
+        # Arming a key again replaces its timer.
+        wheel.arm("b", 0.08, timer("b"))
+        self.assertEqual(len(wheel), 3)
+
+        await asyncio.sleep(0.3)
+        self.assertEqual(fired, ["a", "b", "d"])
+        self.assertEqual(len(wheel), 0)
+        # The task stops once there are no timers left.
+        self.assertTrue(wheel.task.done())
+
+
+class PairChannelLayerTests(SimpleTestCase):
+    def test_groups(self):
+        asyncio.run(self.send_to_groups())
+
+    async def send_to_groups(self):
+        layer = PairChannelLayer()
+        first, second = await layer.new_channel(), await layer.new_channel()
+        await layer.group_add("game", first)
+        await layer.group_add("game", second)
+        await layer.group_send("game", {"type": "game.ping"})
+        self.assertEqual(await layer.receive(first), {"type": "game.ping"})
+        self.assertEqual(await layer.receive(second), {"type": "game.ping"})
+
+        await layer.group_discard("game", first)
+        await layer.group_send("game", {"type": "game.pong"})
+        self.assertEqual(await layer.receive(second), {"type": "game.pong"})
+        self.assertNotIn(first, layer.channels)
+        # Empty queues and groups don't use any memory.
+        await layer.group_discard("game", second)
+        self.assertEqual(layer.stats()["channels"], 0)
+        self.assertEqual(layer.stats()["groups"], 0)
+
+    def test_full_channels(self):
+        asyncio.run(self.fill_channel())
+
+    async def fill_channel(self):
+        layer = PairChannelLayer(capacity=1)
+        channel = await layer.new_channel()
+        await layer.send(channel, {"type": "game.ping"})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {"type": "game.ping"})
+        # Group messages that don't fit are dropped and counted.
+        await layer.group_add("game", channel)
+        await layer.group_send("game", {"type": "game.ping"})
+        self.assertEqual(layer.stats()["dropped"], 1)
+
+
+class ClusterTests(SimpleTestCase):
+    def test_adding_a_worker_only_moves_its_share_of_games(self):
+        ring = HashRing(["w0", "w1", "w2", "w3"])
+        games = [str(game) for game in range(100000, 102000)]
+        before = {game: ring.get(game) for game in games}
+        ring.add("w4")
+        moved = [game for game in games if ring.get(game) != before[game]]
+        # Every game that moved went to the new worker, and it got roughly a fifth of them.
+        self.assertTrue(all(ring.get(game) == "w4" for game in moved))
+        self.assertGreater(len(moved), len(games) * 0.1)
+        self.assertLess(len(moved), len(games) * 0.3)
+
+    def test_games_are_routed_to_one_worker(self):
+        router = Router()
+        router.add_worker("w0", "/tmp/w0.sock")
+        worker, game = router.route("/ws/game/123456/")
+        self.assertEqual(game, "123456")
+        self.assertEqual(router.route("/ws/game/123456/watch/"), (worker, "123456"))
+        self.assertEqual(router.route("/api/games/")[1], None)
+
+    def test_rebalance_keeps_live_games_on_their_worker(self):
+        router = Router()
+        router.add_worker("w0", "/tmp/w0.sock")
+        games = [str(game) for game in range(100000, 100200)]
+        for game in games:
+            router.pin(game, "w0")
+
+        moved = router.rebalance("w1", "/tmp/w1.sock")
+        owners = {game: router.ring.get(game) for game in games}
+        self.assertEqual(moved, sum(owner == "w1" for owner in owners.values()))
+        self.assertGreater(moved, 0)
+        # Pinned games stay where they are until their connections close.
+        self.assertTrue(
+            all(router.route(f"/ws/game/{game}/")[0] == "w0" for game in games)
+        )
+        for game in games:
+            router.unpin(game)
+        self.assertTrue(
+            all(router.route(f"/ws/game/{game}/")[0] == owners[game] for game in games)
+        )
+
+
+class ProtocolTests(SimpleTestCase):
+    FRAMES = [
+        {"message": "waiting for another player"},
+        {"message": "too many messages"},
+        {"message": "player disconnected", "abort": True},
+        {"message": "ready", "player1": "alice", "player2": "bob"},
+        {
+            "message": "your roll",
+            "roll": [3, 3, 5],
+            "double": True,
+            "tiebreaker": False,
+        },
+        {"message": "alice's roll", "roll": [2], "double": False, "tiebreaker": True},
+        {
+            "message": "update",
+            "round": 2,
+            "player": "alice",
+            "roll": [1, 4],
+            "score": 30,
+            "player1_win_probability": 0.75,
+            "player2_win_probability": 0.25,
+        },
+        {
+            "message": "turn",
+            "player": "bob",
+            "roll": [6],
+            "double": False,
+            "tiebreaker": True,
+            "round": 5,
+            "score": None,
+            "player1_score": 40,
+            "player2_score": 40,
+            "next_player": None,
+            "winner": "bob",
+            "player1_win_probability": None,
+            "player2_win_probability": None,
+        },
+        {
+            "message": "watching",
+            "player1": "alice",
+            "player2": "bob",
+            "round": 3,
+            "player1_score": 20,
+            "player2_score": 25,
+            "current_player": "alice",
+            "tiebreaker": False,
+        },
+        {"message": "end", "winner": "bob", "score": 68, "tie": False},
+    ]
+
+    def test_round_trip(self):
+        for frame in self.FRAMES:
+            with self.subTest(message=frame["message"]):
+                self.assertEqual(protocol.decode(protocol.encode(frame)), frame)
+
+    def test_long_usernames(self):
+        frame = {"message": "ready", "player1": "a" * 300, "player2": "bob"}
+        self.assertEqual(protocol.decode(protocol.encode(frame)), frame)
+
+    def test_negotiate(self):
+        self.assertEqual(protocol.negotiate(["chat", protocol.BINARY]), protocol.BINARY)
+        self.assertIsNone(protocol.negotiate([]))
+
+    def test_encoded(self):
+        frame = {"message": "end", "winner": "bob", "score": 68, "tie": True}
+        encoded = protocol.Encoded(frame)
+        # Nothing is encoded until it is asked for, and then only once.
+        self.assertEqual(encoded, {"frame": frame})
+        with mock.patch.object(protocol, "encode", wraps=protocol.encode) as encode:
+            self.assertEqual(protocol.decode(encoded["bytes"]), frame)
+            self.assertIs(encoded["bytes"], encoded["bytes"])
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(json.loads(encoded["text"]), frame)
+        self.assertLess(len(encoded["bytes"]), len(encoded["text"]))
+
+
+class TicketTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="player1", password="password")
+
+    def test_ticket_is_for_its_game(self):
+        ticket = auth.issue_ticket(self.user, "123456")
+        user = auth.verify_ticket(ticket, "123456")
+        self.assertEqual((user.pk, user.username), (self.user.pk, "player1"))
+        self.assertIsNone(auth.verify_ticket(ticket, "654321"))
+
+    def test_tampered_ticket(self):
+        ticket = auth.issue_ticket(self.user, "123456")
+        self.assertIsNone(auth.verify_ticket(ticket[:-1] + "x", "123456"))
+
+    @override_settings(TICKET_TTL=-1)
+    def test_expired_ticket(self):
+        ticket = auth.issue_ticket(self.user, "123456")
+        self.assertIsNone(auth.verify_ticket(ticket, "123456"))
+
+
+class TokenBucketTests(SimpleTestCase):
+    @mock.patch("api.throttling.time.monotonic")
+    def test_bursts_then_rate(self, monotonic):
+        monotonic.return_value = 0
+        bucket = TokenBucket(rate=2, capacity=3)
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+        # Tokens come back at the rate, up to the capacity.
+        monotonic.return_value = 0.5
+        self.assertEqual([bucket.take() for _ in range(2)], [True, False])
+        monotonic.return_value = 100
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+
+
+# This returns a communicator for the supplied websocket path, connected as the supplied user once connect() is called.
+def communicator(path, user, subprotocols=None):
+    connection = WebsocketCommunicator(
+        URLRouter(websocket_urlpatterns), path, subprotocols=subprotocols
+    )
+    connection.scope["user"] = user
+    return connection
+
+
+# This plays one player's side of a game, acknowledging each of their rolls, and returns every frame they were sent.
+# If supplied, on_roll is awaited with each of their rolls before it is acknowledged.
+async def play(connection, on_roll=None):
+    frames = []
+    while True:
+        frame = await connection.receive_json_from(timeout=5)
+        frames.append(frame)
+        if frame["message"] == "your roll":
+            if on_roll is not None:
+                await on_roll(frame)
+            await connection.send_json_to({})
+        elif frame["message"] in ("end", "timed out", "player disconnected"):
+            return frames
+
+
+# This returns the frames each player of a game played with the supplied seed should be sent (as JSON), once they are both connected.
+def expected_frames(seed, player1, player2):
+    replay = dice.replay(seed)
+    names = {1: player1, 2: player2}
+    frames = {1: [], 2: []}
+    scores = [0, 0]
+    for turn in replay["turns"]:
+        player, roll = turn["player"], turn["roll"]
+        double = rules.is_double(roll)
+        frames[player].append(
+            {
+                "message": "your roll",
+                "roll": roll,
+                "double": double,
+                "tiebreaker": False,
+            }
+        )
+        frames[3 - player].append(
+            {
+                "message": f"{names[player]}'s roll",
+                "roll": roll,
+                "double": double,
+                "tiebreaker": False,
+            }
+        )
+        scores[player - 1] = turn["score"]
+        player1_win_probability, player2_win_probability = odds.win_probability(
+            turn["round"], 3 - player, *scores
+        )
+        update = {
+            "message": "update",
+            "round": turn["round"],
+            "player": names[player],
+            "roll": roll,
+            "score": turn["score"],
+            "player1_win_probability": player1_win_probability,
+            "player2_win_probability": player2_win_probability,
+        }
+        frames[1].append(update)
+        frames[2].append(update)
+    for step in replay["tiebreaker"]:
+        for player, roll in enumerate(step, 1):
+            frames[player].append(
+                {
+                    "message": "your roll",
+                    "roll": roll,
+                    "double": False,
+                    "tiebreaker": True,
+                }
+            )
+            frames[3 - player].append(
+                {
+                    "message": f"{names[player]}'s roll",
+                    "roll": roll,
+                    "double": False,
+                    "tiebreaker": True,
+                }
+            )
+    end = {
+        "message": "end",
+        "winner": names[replay["winner"]],
+        "score": max(scores),
+        "tie": bool(replay["tiebreaker"]),
+    }
+    frames[1].append(end)
+    frames[2].append(end)
+    return frames
+
+
+class ConsumerTestCase(TestCase):
+    """
+    Sets up two players for tests that play games through the websockets.
+    """
+
+    # Player 2 wins this game 28 to 22, and the next one is tied at 50 and goes to a tiebreaker.
+    SEED = "0" * 32
+    TIED_SEED = "0" * 31 + "2"
+
+    def setUp(self):
+        self.player1 = User.objects.create_user(username="player1", password="password")
+        self.player2 = User.objects.create_user(username="player2", password="password")
+
+    # A test that fails part way through can leave its game in memory.
+    def tearDown(self):
+        state.games.clear()
+
+    def create_game(self, seed):
+        Game.objects.create(id="123456", dice_seed=seed)
+
+    # This connects both players, player 1 first, checking they are told when the game is ready.
+    async def connect(self):
+        player1 = communicator("/ws/game/123456/", self.player1)
+        player2 = communicator("/ws/game/123456/", self.player2)
+        self.assertTrue((await player1.connect())[0])
+        self.assertEqual(
+            await player1.receive_json_from(),
+            {"message": "waiting for another player"},
+        )
+        self.assertTrue((await player2.connect())[0])
+        ready = {"message": "ready", "player1": "player1", "player2": "player2"}
+        self.assertEqual(await player1.receive_json_from(), ready)
+        self.assertEqual(await player2.receive_json_from(), ready)
+        return player1, player2
+
+
+class DiceGameConsumerTests(ConsumerTestCase):
+    async def play_game(self, seed):
+        await database_sync_to_async(self.create_game)(seed)
+        player1, player2 = await self.connect()
+        frames = await asyncio.gather(play(player1), play(player2))
+        await player1.disconnect()
+        await player2.disconnect()
+        expected = expected_frames(seed, "player1", "player2")
+        self.assertEqual(frames[0], expected[1])
+        self.assertEqual(frames[1], expected[2])
+
+    async def test_game(self):
+        await self.play_game(self.SEED)
+        game = await state.fetch_game("123456")
+        self.assertTrue(game.finished)
+        self.assertEqual(game.winner_id, self.player2.pk)
+        self.assertEqual((game.player1_score, game.player2_score), (22, 28))
+        # Every roll and score was recorded, and the game was dropped from memory once both players left.
+        self.assertEqual(game.event_count, 4 * rules.ROUNDS)
+        self.assertNotIn("123456", state.games)
+
+    async def test_tiebreaker(self):
+        await self.play_game(self.TIED_SEED)
+        game = await state.fetch_game("123456")
+        self.assertTrue(game.finished and game.tiebreaker)
+        self.assertEqual((game.player1_score, game.player2_score), (50, 50))
+        self.assertEqual(
+            game.winner_id,
+            [self.player1.pk, self.player2.pk][
+                dice.replay(self.TIED_SEED)["winner"] - 1
+            ],
+        )
+
+    async def test_game_is_written_back_at_round_boundaries(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        turns = dice.replay(self.SEED)["turns"]
+        rolls = 0
+
+        # Player 1's first roll of each round comes after the previous round has been written back.
+        async def check_row(_frame):
+            nonlocal rolls
+            rolls += 1
+            game = await state.fetch_game("123456")
+            # The game was written when each player joined, and then once per round.
+            self.assertEqual((game.round, game.version), (rolls, rolls + 1))
+            self.assertEqual(game.current_player_id, self.player1.pk)
+            self.assertEqual(
+                (game.player1_score, game.player2_score),
+                (turns[2 * rolls - 4]["score"], turns[2 * rolls - 3]["score"])
+                if rolls > 1
+                else (0, 0),
+            )
+            self.assertEqual(game.event_count, 4 * (rolls - 1))
+
+        player1, player2 = await self.connect()
+        await asyncio.gather(play(player1, check_row), play(player2))
+        self.assertEqual(rolls, rules.ROUNDS)
+        # The game is written once more when it ends.
+        game = await state.fetch_game("123456")
+        self.assertEqual(game.version, rules.ROUNDS + 2)
+        await player1.disconnect()
+        await player2.disconnect()
+
+    async def test_disconnecting_aborts_the_game(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        player1, player2 = await self.connect()
+        self.assertEqual((await player1.receive_json_from())["message"], "your roll")
+        await player1.disconnect()
+
+        self.assertEqual(
+            await player2.receive_json_from(),
+            {"message": "player disconnected", "abort": True},
+        )
+        self.assertEqual((await player2.receive_output())["type"], "websocket.close")
+        # The game is deleted, and dropped from memory straight away.
+        self.assertFalse(
+            await database_sync_to_async(Game.objects.filter(id="123456").exists)()
+        )
+        self.assertNotIn("123456", state.games)
+        await player2.disconnect()
+
+
+# The timers are run on a wheel that ticks every 10ms, so the timeouts can be a fraction of a second.
+@mock.patch("api.consumers.wheel", TimerWheel(tick=0.01, slots=64))
+class TimeoutTests(ConsumerTestCase):
+    @override_settings(TURN_TIMEOUT=0.05)
+    async def test_idle_player_forfeits(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        player1, player2 = await self.connect()
+        # Player 1 never acknowledges their roll.
+        self.assertEqual((await player1.receive_json_from())["message"], "your roll")
+        self.assertEqual(await player1.receive_json_from(), {"message": "timed out"})
+        self.assertEqual(
+            await player2.receive_json_from(),
+            {"message": "end", "winner": "player2", "score": 0, "tie": False},
+        )
+        for player in (player1, player2):
+            self.assertEqual((await player.receive_output())["type"], "websocket.close")
+            await player.disconnect()
+
+        game = await state.fetch_game("123456")
+        self.assertTrue(game.finished)
+        self.assertEqual(game.winner_id, self.player2.pk)
+        self.assertNotIn("123456", state.games)
+
+    @override_settings(WAITING_TIMEOUT=0.05)
+    async def test_lonely_game_is_deleted(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        player1 = communicator("/ws/game/123456/", self.player1)
+        await player1.connect()
+        self.assertEqual(
+            await player1.receive_json_from(),
+            {"message": "waiting for another player"},
+        )
+        self.assertEqual(await player1.receive_json_from(), {"message": "no opponent"})
+        self.assertEqual((await player1.receive_output())["type"], "websocket.close")
+        await player1.disconnect()
+
+        self.assertFalse(
+            await database_sync_to_async(Game.objects.filter(id="123456").exists)()
+        )
+        self.assertNotIn("123456", state.games)
+
+
+class ThrottleTests(ConsumerTestCase):
+    @override_settings(
+        WEBSOCKET_RATE=0.001,
+        WEBSOCKET_BURST=1,
+        WEBSOCKET_DROP_LIMIT=2,
+        WEBSOCKET_DROP_RECOVERY=0.001,
+    )
+    async def test_spammer_is_closed_once(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        player1 = communicator("/ws/game/123456/", self.player1)
+        await player1.connect()
+        self.assertEqual(
+            await player1.receive_json_from(),
+            {"message": "waiting for another player"},
+        )
+        for _ in range(20):
+            await player1.send_json_to({})
+        # The first message is answered, the next two are dropped, and the fourth closes the connection.
+        # Everything sent after that is ignored.
+        self.assertEqual(
+            await player1.receive_json_from(),
+            {"message": "waiting for another player"},
+        )
+        self.assertEqual(
+            await player1.receive_json_from(), {"message": "too many messages"}
+        )
+        self.assertEqual((await player1.receive_output())["type"], "websocket.close")
+        self.assertTrue(await player1.receive_nothing())
+        await player1.disconnect()
+
+
+class GameRetrieveTests(TestCase):
+    def setUp(self):
+        caching.clear()
+        self.user = User.objects.create_user(username="player1", password="password")
+        self.game = Game.objects.create(id="123456", player1=self.user)
+        self.game.players.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        caching.clear()
+
+    def test_unchanged_game_is_not_modified(self):
+        response = self.client.get("/api/games/123456/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], '"123456-0"')
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/games/123456/", HTTP_IF_NONE_MATCH='"123456-0"'
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_game_is_sent_again(self):
+        self.client.get("/api/games/123456/")
+        Game.objects.filter(id="123456").update(version=F("version") + 1, finished=True)
+        caching.clear()
+        response = self.client.get(
+            "/api/games/123456/", HTTP_IF_NONE_MATCH='"123456-0"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], '"123456-1"')
+        self.assertTrue(response.json()["finished"])
+        # Finished games never change, so clients can keep them.
+        self.assertEqual(
+            response["Cache-Control"], f"max-age={settings.FINISHED_GAME_CACHE_TTL}"
+        )
+
+    # Only players can see a game if GamePermission checks it, and a snapshot cached for one of them must not be served to anyone else.
+    @mock.patch.object(
+        permissions.GamePermission,
+        "has_object_permission",
+        lambda self, request, view, game: request.user in game.players.all(),
+    )
+    def test_cached_game_is_still_checked(self):
+        self.assertEqual(self.client.get("/api/games/123456/").status_code, 200)
+        other = APIClient()
+        other.force_authenticate(
+            User.objects.create_user(username="player2", password="password")
+        )
+        self.assertEqual(other.get("/api/games/123456/").status_code, 403)
+        # Anonymous users are asked to log in.
+        self.assertEqual(APIClient().get("/api/games/123456/").status_code, 401)
+        # The player who has already been checked is still served from the cache.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/games/123456/").status_code, 200)
+
+
+class GameHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="player1", password="password")
+        self.other = User.objects.create_user(username="player2", password="password")
+        self.ids = []
+        for game in range(45):
+            game = Game.objects.create(
+                id=f"{game:06}", player1=self.user, player2=self.other
+            )
+            game.players.add(self.user, self.other)
+            self.ids.append(game.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_cover_every_game_newest_first(self):
+        url = f"/api/users/{self.user.pk}/games/"
+        ids = []
+        while url:
+            # Each page is the user, the games with their winners, and their players.
+            with self.assertNumQueries(3):
+                page = self.client.get(url).json()
+            ids.extend(game["id"] for game in page["results"])
+            url = page["next"]
+        self.assertEqual(ids, self.ids[::-1])
+        self.assertEqual(page["results"][0]["players"], ["player1", "player2"])
+
+    def test_only_the_user_can_list_their_games(self):
+        response = self.client.get(f"/api/users/{self.other.pk}/games/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_user_does_not_embed_games(self):
+        response = self.client.get(f"/api/users/{self.user.pk}/")
+        self.assertNotIn("games", response.json())
+
+
+class BroadcastTests(ConsumerTestCase):
+    # Players using JSON without ?frames=turn, with no one watching, only need the roll and update frames of each turn in JSON.
+    async def test_frames_are_only_encoded_when_sent(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        missing = protocol.Encoded.__missing__
+        with mock.patch.object(
+            protocol.Encoded, "__missing__", autospec=True, side_effect=missing
+        ) as encode:
+            player1, player2 = await self.connect()
+            await asyncio.gather(play(player1), play(player2))
+        await player1.disconnect()
+        await player2.disconnect()
+        formats = [call.args[1] for call in encode.call_args_list]
+        # The ready frame, then the roll and update frames of every turn.
+        self.assertEqual(formats, ["text"] * (1 + 2 * 2 * rules.ROUNDS))
+
+
+# This returns every frame a spectator is sent until they are disconnected, decoding binary frames.
+async def watch(connection):
+    frames = []
+    while True:
+        output = await connection.receive_output(timeout=5)
+        if output["type"] == "websocket.close":
+            return frames
+        if output.get("bytes") is not None:
+            frames.append(protocol.decode(output["bytes"]))
+        else:
+            frames.append(json.loads(output["text"]))
+
+
+class SpectatorTests(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spectator = User.objects.create_user(
+            username="spectator", password="password"
+        )
+        self.slow = User.objects.create_user(username="slow", password="password")
+
+    # This connects a spectator to the game, checking they are sent where the game is up to.
+    async def spectate(self, user, subprotocols=None):
+        spectator = communicator("/ws/game/123456/watch/", user, subprotocols)
+        self.assertTrue((await spectator.connect())[0])
+        self.assertEqual(
+            await spectator.receive_json_from()
+            if subprotocols is None
+            else protocol.decode(await spectator.receive_from()),
+            {
+                "message": "watching",
+                "player1": "player1",
+                "player2": None,
+                "round": 1,
+                "player1_score": 0,
+                "player2_score": 0,
+                "current_player": None,
+                "tiebreaker": False,
+            },
+        )
+        return spectator
+
+    @override_settings(SPECTATOR_BUFFER=4)
+    async def test_spectators_are_sent_every_turn(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        player1 = communicator("/ws/game/123456/", self.player1)
+        await player1.connect()
+        await player1.receive_json_from()
+
+        # Spectators share the players' state, so they never load the game themselves.
+        with mock.patch.object(state, "fetch_game", side_effect=AssertionError):
+            spectators = [
+                await self.spectate(
+                    self.spectator, [protocol.BINARY] if number % 2 else None
+                )
+                for number in range(100)
+            ]
+
+        # A spectator that never keeps up is disconnected once SPECTATOR_BUFFER frames are waiting, and the game carries on without them.
+        stuck = asyncio.Event()
+        send_encoded = SpectatorConsumer.send_encoded
+
+        async def slow_send(consumer, frame):
+            if consumer.scope["user"] == self.slow:
+                await stuck.wait()
+            await send_encoded(consumer, frame)
+
+        with mock.patch.object(SpectatorConsumer, "send_encoded", slow_send):
+            slow = await self.spectate(self.slow)
+            player2 = communicator("/ws/game/123456/", self.player2)
+            await player2.connect()
+            await player1.receive_json_from()
+            await player2.receive_json_from()
+            frames = await asyncio.gather(play(player1), play(player2))
+            self.assertEqual((await slow.receive_output())["type"], "websocket.close")
+        expected = expected_frames(self.SEED, "player1", "player2")
+        self.assertEqual(frames[0], expected[1])
+        self.assertEqual(frames[1], expected[2])
+
+        turns = [
+            {key: turn[key] for key in ("player", "roll", "score")}
+            for turn in dice.replay(self.SEED)["turns"]
+        ]
+        for spectator in spectators:
+            watched = await watch(spectator)
+            self.assertEqual(
+                watched[0],
+                {"message": "ready", "player1": "player1", "player2": "player2"},
+            )
+            self.assertEqual(
+                [
+                    {
+                        "player": {"player1": 1, "player2": 2}[frame["player"]],
+                        "roll": frame["roll"],
+                        "score": frame["score"],
+                    }
+                    for frame in watched[1:-1]
+                ],
+                turns,
+            )
+            self.assertEqual(watched[-1], expected[1][-1])
+
+        for connection in [player1, player2, slow, *spectators]:
+            await connection.disconnect()
+        self.assertNotIn("123456", state.games)
+
+    async def test_anonymous_users_cannot_watch(self):
+        await database_sync_to_async(self.create_game)(self.SEED)
+        spectator = communicator("/ws/game/123456/watch/", AnonymousUser())
+        await spectator.connect()
+        self.assertEqual(
+            await spectator.receive_json_from(), {"message": "unauthorised"}
+        )
+        self.assertEqual((await spectator.receive_output())["type"], "websocket.close")
+        await spectator.disconnect()
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.player1 = User.objects.create_user(username="player1", password="password")
+        self.player2 = User.objects.create_user(username="player2", password="password")
+
+    def create_game(self, id, player1_score, player2_score, winner=None):
+        return Game.objects.create(
+            id=id,
+            player1=self.player1,
+            player2=self.player2,
+            player1_score=player1_score,
+            player2_score=player2_score,
+            finished=winner is not None,
+            winner=winner,
+        )
+
+    # This finishes the supplied game through its GameState, as the consumers do, and returns its leaderboard entry.
+    def finish(self, id, winner):
+        game = async_to_sync(state.load_game)(id)
+        game.winner = winner
+        game.finished = True
+        self.assertTrue(async_to_sync(game.flush)())
+        return LeaderboardEntry.objects.get(game_id=id)
+
+    def test_finished_game_is_added(self):
+        self.create_game("123456", 40, 30)
+        entry = self.finish("123456", self.player1)
+        self.assertEqual((entry.winner_id, entry.score), (self.player1.pk, 40))
+
+    def test_forfeited_game_has_the_winners_score(self):
+        # Player 1 was ahead, but forfeited (see DiceGameConsumer.turn_timeout).
+        self.create_game("123456", 60, 20)
+        entry = self.finish("123456", self.player2)
+        self.assertEqual((entry.winner_id, entry.score), (self.player2.pk, 20))
+
+    def test_rebuild(self):
+        self.create_game("111111", 50, 40, self.player1)
+        self.create_game("222222", 30, 10, self.player2)
+        live = self.create_game("333333", 20, 0)
+        # Entries that are wrong or for games that haven't finished are replaced.
+        LeaderboardEntry.objects.create(game=live, winner=self.player1, score=20)
+
+        output = StringIO()
+        call_command("rebuild_leaderboard", "--batch-size", "1", stdout=output)
+        self.assertEqual(
+            output.getvalue().strip(), "Rebuilt the leaderboard from 2 finished games."
+        )
+        self.assertEqual(
+            list(LeaderboardEntry.objects.values_list("game", "winner", "score")),
+            [("111111", self.player1.pk, 50), ("222222", self.player2.pk, 10)],
+        )
@@ -0,0 +1,26 @@
+# Here, the throttling of the messages clients send over websockets is defined.
+# The DRF throttles (see REST_FRAMEWORK in settings.py) only cover HTTP requests, so each websocket connection has its own token buckets.
+
+import time
+
+
+class TokenBucket:
+    """
+    A token bucket which holds up to capacity tokens and refills at rate tokens a second.
+    Each take() uses a token if there is one, so on average rate calls a second succeed, in bursts of up to capacity.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
@@ -0,0 +1,70 @@
+# Here, the turn deadlines of every live game are tracked.
+# Rather than a timer task per connection, each worker has a single hashed timer wheel driven by one asyncio task.
+
+import asyncio
+import math
+
+
+class TimerWheel:
+    """
+    A hashed timer wheel which tracks any number of deadlines with a single asyncio task.
+    The wheel is a ring of slots which the task steps through once per tick, and each timer sits in the slot its deadline falls in.
+    Arming and cancelling a timer are O(1), and each tick only looks at the timers in one slot.
+    """
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick
+        # Each slot maps a timer's key to [the number of full turns of the wheel left, the callback].
+        self.slots = [{} for _ in range(slots)]
+        # This maps each timer's key to the slot it is in, so it can be found when cancelling.
+        self.timers = {}
+        self.cursor = 0
+        self.task = None
+
+    def __len__(self):
+        return len(self.timers)
+
+    # This arms a timer which calls the supplied coroutine function after roughly delay seconds (rounded up to a whole tick).
+    # Arming a key that is already armed replaces its timer.
+    def arm(self, key, delay, callback):
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot][key] = [(ticks - 1) // len(self.slots), callback]
+        self.timers[key] = slot
+        self.start()
+
+    def cancel(self, key):
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    # This starts the task that turns the wheel, if it isn't running already in this event loop.
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        # The task stops once there are no timers left, and is started again by the next arm().
+        while self.timers:
+            # Ticks are scheduled from the start time rather than the end of the last one, so the wheel doesn't drift.
+            next_tick += self.tick
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            self.expire(self.slots[self.cursor])
+
+    def expire(self, slot):
+        for key, timer in list(slot.items()):
+            if timer[0]:
+                timer[0] -= 1
+                continue
+            del slot[key]
+            del self.timers[key]
+            asyncio.ensure_future(timer[1]())
+
+
+# This is the timer wheel for this worker.
+wheel = TimerWheel()
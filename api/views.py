@@ -1,8 +1,16 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status, viewsets
 
-from . import models, permissions, serialisers
+from . import auth, caching, models, odds, pagination, permissions, serialisers
 
 
 class UserViewSet(viewsets.ViewSet):
@@ -40,16 +48,36 @@ class UserViewSet(viewsets.ViewSet):
         )
         serialiser.is_valid(raise_exception=True)
         serialiser.save()
+        # The user's cached websocket credentials may have changed (e.g. their password), so they have to be verified again.
+        auth.credentials.invalidate(user.pk)
+        # The cached leaderboard may show their old username.
+        caching.delete(caching.LEADERBOARD)
         # Return the updated user.
         serialiser = serialisers.UserSerialiser(user, context={"request": request})
         return Response(serialiser.data)
 
+    @action(detail=True, methods=["get"])
+    def games(self, request, pk=None):
+        """Lists the games the supplied user has played, newest first, a page at a time."""
+        user = get_object_or_404(models.User.objects.only("id"), pk=pk)
+        self.check_object_permissions(request, user)
+        # Each page is one query for the games (with their winners) and one for their players.
+        queryset = user.games.select_related("winner").prefetch_related("players")
+        paginator = pagination.GameHistoryPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serialiser = serialisers.GameSummarySerialiser(
+            page, many=True, context={"request": request}
+        )
+        return paginator.get_paginated_response(serialiser.data)
+
     def destroy(self, request, pk=None):
         """Deletes the supplied user."""
         queryset = models.User.objects.all()
         user = get_object_or_404(queryset, pk=pk)
         self.check_object_permissions(request, user)
+        auth.credentials.invalidate(user.pk)
         user.delete()
+        caching.delete(caching.LEADERBOARD)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -63,11 +91,52 @@ class GameViewSet(viewsets.ViewSet):
 
     def retrieve(self, request, pk=None):
         """Retrieves details on the supplied game."""
-        queryset = models.Game.objects.all()
-        game = get_object_or_404(queryset, pk=pk)
-        self.check_object_permissions(request, game)
+        # Games are served from a snapshot of their serialised JSON, which is cached through api/caching.py.
+        # Finished games never change so their snapshots are kept for a long time, live games' only for a moment.
+        # A cached snapshot is only served to users who have already passed the permission check for the game (see GamePermission),
+        # which is remembered for as long as the snapshot. Anyone else has the game loaded and checked first.
+        access_key = caching.game_access_key(pk, request.user.pk)
+        snapshot = caching.get(caching.game_key(pk))
+        if snapshot is None or caching.get(access_key) is None:
+            queryset = models.Game.objects.prefetch_related("players")
+            game = get_object_or_404(queryset, pk=pk)
+            self.check_object_permissions(request, game)
+            snapshot = self.snapshot(request, game)
+            timeout = (
+                settings.FINISHED_GAME_CACHE_TTL
+                if game.finished
+                else settings.GAME_SNAPSHOT_TTL
+            )
+            caching.set(caching.game_key(pk), snapshot, timeout)
+            caching.set(access_key, True, timeout)
+
+        # The version is bumped on every write, so clients with the current version are just told it hasn't changed.
+        response = get_conditional_response(
+            request, etag=snapshot["etag"], last_modified=snapshot["last_modified"]
+        )
+        if response is None:
+            if request.accepted_renderer.format == "json":
+                response = HttpResponse(
+                    snapshot["body"], content_type="application/json"
+                )
+            else:
+                response = Response(json.loads(snapshot["body"]))
+        response["ETag"] = snapshot["etag"]
+        response["Last-Modified"] = http_date(snapshot["last_modified"])
+        if snapshot["finished"]:
+            patch_cache_control(response, max_age=settings.FINISHED_GAME_CACHE_TTL)
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def snapshot(self, request, game):
         serialiser = serialisers.GameSerialiser(game, context={"request": request})
-        return Response(serialiser.data)
+        return {
+            "etag": f'"{game.id}-{game.version}"',
+            "last_modified": int(game.updated_at.timestamp()),
+            "finished": game.finished,
+            "body": JSONRenderer().render(serialiser.data),
+        }
 
     def create(self, request):
         """Creates a new game."""
@@ -77,3 +146,28 @@ class GameViewSet(viewsets.ViewSet):
         serialiser.is_valid(raise_exception=True)
         serialiser.save(user=request.user)
         return Response(serialiser.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=["post"])
+    def ticket(self, request, pk=None):
+        """Issues a short-lived ticket for connecting to the supplied game's websockets with ?ticket=."""
+        game = get_object_or_404(models.Game.objects.only("id"), pk=pk)
+        self.check_object_permissions(request, game)
+        return Response(
+            {
+                "ticket": auth.issue_ticket(request.user, game.id),
+                "expires_in": settings.TICKET_TTL,
+            }
+        )
+
+
+class OddsViewSet(viewsets.ViewSet):
+    """
+    Odds view set containing a view for the exact odds of the game.
+    These are calculated from the rules when the server starts (see odds.py).
+    """
+
+    permission_classes = [permissions.OddsPermission]
+
+    def list(self, request):
+        """Retrieves the exact odds of the game."""
+        return Response(odds.get())
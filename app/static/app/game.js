@@ -113,6 +113,49 @@ socket.addEventListener("message", (event) => {
 			window.location.href = "";
 			break;
 
+		// If we took too long to roll, we forfeit the game and the server disconnects us.
+		case "timed out":
+			alert(
+				"You took too long to roll so you have forfeited the game. You will be redirected to the results."
+			);
+			window.location.href = window.location.href + "results/";
+			break;
+
+		// If no one joined the game in time, the server disconnects us and cancels the game.
+		case "no opponent":
+			alert(
+				"No one joined the game in time so it has been cancelled. You will be redirected to the home page."
+			);
+			window.location.href = "/";
+			break;
+
+		// If both seats are taken by other players, the server refuses us.
+		case "game is full":
+			alert(
+				"This game already has two players. You will be redirected to the home page."
+			);
+			window.location.href = "/";
+			break;
+
+		// The server refuses us for these too, e.g. if the game finished or was deleted while the page was open.
+		case "game has finished":
+			window.location.href = window.location.href + "results/";
+			break;
+
+		case "game does not exist":
+		case "unauthorised":
+			alert("You can't join this game. You will be redirected to the home page.");
+			window.location.href = "/";
+			break;
+
+		// If we sent too many messages, the server disconnects us.
+		case "too many messages":
+			alert(
+				"You sent too many messages so you have been disconnected. You will be redirected to the home page."
+			);
+			window.location.href = "/";
+			break;
+
 		// We ignore these messages.
 		case "waiting for another player":
 			break;
@@ -1,3 +1,88 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api import caching, state
+from api.models import Game, LeaderboardEntry, User
+
+
+# This returns the queries that read games (or the leaderboard) out of the supplied ones.
+def game_queries(queries):
+    return [
+        query["sql"]
+        for query in queries
+        if "api_game" in query["sql"] or "api_leaderboardentry" in query["sql"]
+    ]
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        caching.clear()
+        self.user = User.objects.create_user(username="player1", password="password")
+        self.other = User.objects.create_user(username="player2", password="password")
+        for score in (30, 40, 50):
+            self.finish(f"game{score}", score)
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        caching.clear()
+
+    def finish(self, id, score):
+        game = Game.objects.create(
+            id=id,
+            player1=self.user,
+            player2=self.other,
+            player1_score=score,
+            player2_score=score - 10,
+            finished=True,
+            winner=self.user,
+        )
+        LeaderboardEntry.objects.create(game=game, winner=self.user, score=score)
+
+    def test_warm_home_makes_no_game_queries(self):
+        self.client.get(reverse("app:home"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("app:home"))
+        self.assertContains(response, "game50")
+        self.assertEqual(game_queries(queries), [])
+
+    def test_warm_results_make_no_game_queries(self):
+        url = reverse("app:game_results", args=["game40"])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, "player2")
+        self.assertEqual(game_queries(queries), [])
+
+    # The game is finished the way the consumers finish it, so the leaderboard entry and the invalidation both come from GameState.flush.
+    def test_finishing_a_game_invalidates_the_leaderboard(self):
+        Game.objects.create(
+            id="game60",
+            player1=self.user,
+            player2=self.other,
+            player1_score=60,
+            player2_score=50,
+        )
+        self.assertNotContains(self.client.get(reverse("app:home")), "game60")
+        game = async_to_sync(state.load_game)("game60")
+        game.winner = self.user
+        game.finished = True
+        async_to_sync(game.flush)()
+        self.assertContains(self.client.get(reverse("app:home")), "game60")
+
+    # Another process may have missed the invalidation, but its copy of a value still expires when the value does.
+    @mock.patch("api.caching.time")
+    def test_local_copies_expire_with_the_cached_value(self, clock):
+        clock.time.return_value = clock.monotonic.return_value = 1000
+        caching.set(caching.LEADERBOARD, ["game50"], 60)
+        caching.local.clear()
 
-# Create your tests here.
+        clock.time.return_value = clock.monotonic.return_value = 1050
+        self.assertEqual(caching.get(caching.LEADERBOARD), ["game50"])
+        clock.time.return_value = clock.monotonic.return_value = 1061
+        self.assertIsNone(caching.local.get(caching.LEADERBOARD))
+        self.assertIsNone(caching.get(caching.LEADERBOARD))
@@ -4,42 +4,57 @@ from django.contrib.auth import authenticate
 from django.contrib.auth import login as login_user
 from django.contrib.auth import logout as logout_user
 from django.contrib import messages
+from django.conf import settings
 from django.shortcuts import redirect, render
-from api.models import Game, User
+from api import caching
+from api.models import Game, LeaderboardEntry, User
 
 
 # This function gets the top 5 games by score for the leaderboard.
+# Every finished game has a leaderboard entry with the winning score (see LeaderboardEntry), so this is a single query over the score index.
 def get_top_five_games():
-    # Since we have two separate scores, we get the 5 top games by player1_score and player2_score so we can combine them.
-    top_games = Game.objects.filter(finished=True).order_by("-player1_score")[:5]
-    top_games2 = Game.objects.filter(finished=True).order_by("-player2_score")[:5]
-
-    # We combine the two lists and then sort them.
-    # We use a lambda function to sort by the higher score, and then reverse the list so it is in descending order.
-    combined = set(list(top_games) + list(top_games2))
-    top_games = sorted(
-        combined,
-        key=lambda x: x.player1_score
-        if x.player1_score > x.player2_score
-        else x.player2_score,
-        reverse=True,
-    )[:5]
-
-    games = []
+    entries = LeaderboardEntry.objects.select_related("winner")[:5]
 
     # We just want to return the game code, winner, and score of the winner.
-    for game in top_games:
-        games.append(
-            (
-                game.id,
-                game.winner,
-                game.player1_score
-                if game.player1_score > game.player2_score
-                else game.player2_score,
-            )
-        )
+    return [
+        (entry.game_id, entry.winner.username if entry.winner else None, entry.score)
+        for entry in entries
+    ]
 
-    return games
+
+# This function gets the leaderboard through the cache (see api/caching.py), it is invalidated whenever a game finishes.
+def get_leaderboard():
+    return caching.get_or_set(
+        caching.LEADERBOARD, get_top_five_games, settings.LEADERBOARD_CACHE_TTL
+    )
+
+
+# This function works out the winner and loser of a game, and their scores.
+# None is returned if the game does not exist or isn't finished yet, otherwise the results never change so they can be cached.
+def get_results(id):
+    # Both seats are loaded with the game so we don't need extra queries to work out the winner and loser.
+    game = (
+        Game.objects.select_related("player1", "player2")
+        .filter(id=id, finished=True)
+        .first()
+    )
+    if game is None:
+        return None
+
+    # The winner is usually the player with the higher score, but not if their opponent forfeited.
+    if game.winner_id == game.player1_id:
+        winner, loser = game.player1, game.player2
+        winning_score, losing_score = game.player1_score, game.player2_score
+    else:
+        winner, loser = game.player2, game.player1
+        winning_score, losing_score = game.player2_score, game.player1_score
+
+    return {
+        "winner": winner.username,
+        "loser": loser.username,
+        "winning_score": winning_score,
+        "losing_score": losing_score,
+    }
 
 
 # This logic is run when the user visits the login page.
@@ -105,7 +120,7 @@ def home(request):
         messages.error(request, "You must be logged in to view this page.")
         return redirect("app:login")
 
-    games = get_top_five_games()
+    games = get_leaderboard()
 
     return render(
         request,
@@ -136,36 +151,25 @@ def game_results(request, id):
     if not request.user.is_authenticated:
         messages.error(request, "You must be logged in to view this page.")
         return redirect("app:login")
-    try:
-        game = Game.objects.get(id=id)
-    except Game.DoesNotExist:
-        messages.error(request, "That game does not exist.")
-        return redirect("app:home")
+    # The results are read through the cache, so only the first view of a finished game's results touches the database.
+    results = caching.get_or_set(
+        caching.results_key(id), lambda: get_results(id), settings.RESULTS_CACHE_TTL
+    )
 
     # We used to stop players from viewing the results of games they were not in, but this was deemed unnecessary.
     # if not game.players.contains(request.user):
     #     messages.error(request, "You are not a player in this game.")
     #     return redirect("app:home")
 
-    if not game.finished:
-        messages.error(request, "This game is not finished yet.")
+    if results is None:
+        if not Game.objects.filter(id=id).exists():
+            messages.error(request, "That game does not exist.")
+        else:
+            messages.error(request, "This game is not finished yet.")
         return redirect("app:home")
 
-    # We calculate the winner and loser of the game, and their scores.
-
-    if game.player1_score > game.player2_score:
-        winner = game.players.first().username
-        winning_score = game.player1_score
-        loser = game.players.last().username
-        losing_score = game.player2_score
-    else:
-        winner = game.players.last().username
-        winning_score = game.player2_score
-        loser = game.players.first().username
-        losing_score = game.player1_score
-
-    games = get_top_five_games()
-    top_5 = game.id in map(lambda x: x[0], games)
+    games = get_leaderboard()
+    top_5 = id in map(lambda x: x[0], games)
 
     return render(
         request,
@@ -173,11 +177,7 @@ def game_results(request, id):
         {
             "title": id,
             "id": id,
-            "game": game,
-            "winner": winner,
-            "loser": loser,
-            "winning_score": winning_score,
-            "losing_score": losing_score,
+            **results,
             "top_5": top_5,
         },
     )